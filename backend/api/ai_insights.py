@@ -1,31 +1,165 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from typing import Dict, List, Any, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from services.ai_study_features import AIStudyFeatures
 from services.smart_document_processor import SmartDocumentProcessor
-from core.database import get_document_collection
+from core.database import get_database, load_document_content
+from core.cache import TTLCache, make_etag, etag_matches
+from core.config import get_settings
+from services.llama_service import llama_ai_service
+from datetime import datetime
+from pymongo import UpdateOne
+import asyncio
+import hashlib
+import json
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+settings = get_settings()
+
 router = APIRouter()
 
-# Initialize AI services
-ai_study_features = AIStudyFeatures()
-smart_processor = SmartDocumentProcessor()
+# AI services are built on first use, once per worker
+_services: Dict[str, Any] = {}
+_services_lock = asyncio.Lock()
+
+# Only the most recent documents are sent through the AI analyzers
+DASHBOARD_ANALYSIS_LIMIT = 10
+
+# Per-document analysis prompts, answered as JSON in one generation batch per analyzer
+LEARNING_PATTERN_PROMPT = """Analyze this study material and the student's quiz results for learning patterns.
+Respond with only a JSON object: {{"patterns": [{{"pattern": "short name", "description": "one sentence", "confidence": 0.0}}]}}
+Quiz results: {quiz_performance}
+Material: {content}"""
+COMPREHENSION_GAP_PROMPT = """Identify concepts in this study material the student has not yet understood, using their quiz results.
+Respond with only a JSON object: {{"gaps": [{{"concept": "concept name", "description": "one sentence", "severity": "low|medium|high"}}]}}
+Quiz results: {quiz_performance}
+Material: {content}"""
+ANALYSIS_CONTENT_TOKENS = 512
+ANALYSIS_MAX_NEW_TOKENS = 256
+JSON_OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+
+# Final payloads keyed by (user_id, document-set fingerprint)
+dashboard_cache = TTLCache(maxsize=settings.dashboard_cache_size, ttl=settings.dashboard_cache_ttl)
+recommendations_cache = TTLCache(maxsize=settings.dashboard_cache_size, ttl=settings.dashboard_cache_ttl)
+
+def document_set_fingerprint(documents) -> str:
+    """Hash document ids and modification times so any upload, edit or delete changes the key"""
+    digest = hashlib.blake2b(digest_size=16)
+    for doc in sorted(documents, key=lambda d: str(d["_id"])):
+        modified = doc.get("updated_at") or doc.get("upload_date")
+        digest.update(f"{doc['_id']}:{modified}|".encode())
+    return digest.hexdigest()
+
+async def _get_service(name: str, factory):
+    """Return a shared service instance, constructing it on first use"""
+    service = _services.get(name)
+    if service is None:
+        async with _services_lock:
+            service = _services.get(name)
+            if service is None:
+                # Construction may load models; keep it off the event loop
+                service = await asyncio.to_thread(factory)
+                _services[name] = service
+    return service
+
+async def get_ai_study_features() -> AIStudyFeatures:
+    """Get the shared AIStudyFeatures instance"""
+    return await _get_service("ai_study_features", AIStudyFeatures)
+
+async def get_smart_processor() -> SmartDocumentProcessor:
+    """Get the shared SmartDocumentProcessor instance"""
+    return await _get_service("smart_processor", SmartDocumentProcessor)
+
+async def get_user_fingerprint(documents_collection, user_id: str) -> str:
+    """Fingerprint a user's documents using only their ids and timestamps"""
+    documents = await documents_collection.find(
+        {"user_id": user_id},
+        {"_id": 1, "updated_at": 1, "upload_date": 1}
+    ).to_list(length=None)
+    return document_set_fingerprint(documents)
+
+def build_dashboard_pipeline(user_id: str) -> List[Dict[str, Any]]:
+    """Aggregate per-user document counts and the recent analysis window in MongoDB"""
+    return [
+        {"$match": {"user_id": user_id}},
+        {"$project": {
+            "content_len": {"$ifNull": [
+                "$content_length",
+                {"$strLenCP": {"$ifNull": ["$content", ""]}}
+            ]},
+            "quiz_results": 1,
+            "created_at": 1
+        }},
+        {"$facet": {
+            "count": [{"$count": "n"}],
+            "recent": [
+                {"$match": {"content_len": {"$gt": 0}}},
+                {"$sort": {"created_at": -1}},
+                {"$limit": DASHBOARD_ANALYSIS_LIMIT}
+            ]
+        }}
+    ]
+
+def parse_analysis_list(response: str, key: str) -> List[Dict[str, Any]]:
+    """Pull a list of dicts out of a model reply, or an empty list if it is not valid JSON"""
+    match = JSON_OBJECT_PATTERN.search(response)
+    if not match:
+        return []
+    try:
+        items = json.loads(match.group(0)).get(key, [])
+    except (ValueError, AttributeError):
+        return []
+    return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+async def run_document_analysis(template: str, key: str, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Answer one analysis prompt per document in a single generate_batch call"""
+    if not batch:
+        return []
+    if not llama_ai_service.initialized:
+        await llama_ai_service.initialize()
+    
+    contents = await asyncio.to_thread(
+        lambda: [llama_ai_service.truncate_to_tokens(item['document_content'], ANALYSIS_CONTENT_TOKENS) for item in batch]
+    )
+    prompts = [
+        template.format(quiz_performance=json.dumps(item['quiz_performance'], default=str), content=content)
+        for item, content in zip(batch, contents)
+    ]
+    responses = await llama_ai_service.generate_batch(prompts, ANALYSIS_MAX_NEW_TOKENS, temperature=0.3)
+    return [{key: parse_analysis_list(response, key)} for response in responses]
+
+async def analyze_learning_patterns_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Learning patterns for each document, as {'patterns': [...]}"""
+    results = await run_document_analysis(LEARNING_PATTERN_PROMPT, 'patterns', batch)
+    
+    # The efficiency score compares confidences numerically
+    for result in results:
+        for pattern in result['patterns']:
+            try:
+                pattern['confidence'] = float(pattern.get('confidence', 0))
+            except (TypeError, ValueError):
+                pattern['confidence'] = 0.0
+    return results
+
+async def identify_comprehension_gaps_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Comprehension gaps for each document, as {'gaps': [...]}"""
+    return await run_document_analysis(COMPREHENSION_GAP_PROMPT, 'gaps', batch)
 
 class StudyAnalysisRequest(BaseModel):
     document_id: str
     user_id: str = "anonymous"
 
 class LearningPatternRequest(BaseModel):
-    quiz_results: List[Dict[str, Any]]
+    quiz_results: List[Dict[str, Any]] = Field(default_factory=list)
     user_id: str = "anonymous"
 
 class StudyPlanRequest(BaseModel):
     document_id: str
     user_id: str = "anonymous"
-    study_goals: Optional[List[str]] = []
+    study_goals: Optional[List[str]] = Field(default_factory=list)
     time_available: Optional[int] = 60  # minutes per day
 
 class RealtimeAssistanceRequest(BaseModel):
@@ -34,45 +168,99 @@ class RealtimeAssistanceRequest(BaseModel):
     user_id: str = "anonymous"
 
 @router.get("/ai-insights/dashboard/{user_id}")
-async def get_ai_insights_dashboard(user_id: str = "anonymous"):
+async def get_ai_insights_dashboard(request: Request, response: Response, user_id: str = "anonymous"):
     """Get comprehensive AI insights dashboard data"""
     try:
-        # Get user's documents
-        documents_collection = get_document_collection()
-        user_documents = list(documents_collection.find({"user_id": user_id}))
+        db = await get_database()
+        documents_collection = db.documents
         
-        if not user_documents:
-            return {
+        # Serve the cached payload while the user's documents are unchanged
+        cache_key = (user_id, await get_user_fingerprint(documents_collection, user_id))
+        etag = make_etag(*cache_key)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        
+        cached = dashboard_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Count documents and pick the analysis window server-side
+        aggregation = await documents_collection.aggregate(
+            build_dashboard_pipeline(user_id)
+        ).to_list(length=1)
+        facets = aggregation[0] if aggregation else {"count": [], "recent": []}
+        total_documents = facets["count"][0]["n"] if facets["count"] else 0
+        
+        if not total_documents:
+            dashboard = {
                 "study_efficiency": {"score": 0, "trend": "stable", "insights": []},
                 "learning_patterns": [],
                 "knowledge_gaps": [],
                 "recommendations": []
             }
+            dashboard_cache.set(cache_key, dashboard)
+            return dashboard
+        
+        # Fetch full content only for the documents we actually analyze
+        recent_ids = [doc["_id"] for doc in facets["recent"]]
+        content_docs = await documents_collection.find(
+            {"_id": {"$in": recent_ids}},
+            {"content": 1, "content_id": 1}
+        ).to_list(length=None)
+        texts = await asyncio.gather(*(load_document_content(doc) for doc in content_docs))
+        contents = {doc["_id"]: text for doc, text in zip(content_docs, texts)}
+        user_documents = [
+            {**doc, "content": contents.get(doc["_id"], "")}
+            for doc in facets["recent"]
+        ]
+        
+        # Analyze every document in one batched call per analyzer so the
+        # model backend can run the prompts as a single forward batch
+        analyzed_documents = [doc for doc in user_documents if doc.get('content')]
+        batch = [
+            {
+                'document_content': doc['content'],
+                'timestamp': doc.get('created_at', ''),
+                'quiz_performance': doc.get('quiz_results', [])
+            }
+            for doc in analyzed_documents
+        ]
+        pattern_results, gap_results = await asyncio.gather(
+            analyze_learning_patterns_batch(batch),
+            identify_comprehension_gaps_batch(batch)
+        )
+        results = list(zip(pattern_results, gap_results))
+        
+        # Persist per-document analysis in a single unordered bulk write
+        if analyzed_documents:
+            analyzed_at = datetime.utcnow()
+            try:
+                await documents_collection.bulk_write([
+                    UpdateOne(
+                        {"_id": doc["_id"]},
+                        {"$set": {
+                            "cached_patterns": patterns.get('patterns', []),
+                            "cached_gaps": gaps.get('gaps', []),
+                            "analyzed_at": analyzed_at
+                        }}
+                    )
+                    for doc, (patterns, gaps) in zip(analyzed_documents, results)
+                ], ordered=False)
+            except Exception as e:
+                logger.warning(f"Failed to persist dashboard analysis: {str(e)}")
         
-        # Analyze learning patterns from documents
         learning_patterns = []
         knowledge_gaps = []
         recommendations = []
         
-        for doc in user_documents:
-            if doc.get('content'):
-                # Analyze document for learning insights
-                patterns = await ai_study_features.analyze_learning_patterns({
-                    'document_content': doc['content'],
-                    'timestamp': doc.get('created_at', ''),
-                    'quiz_performance': doc.get('quiz_results', [])
-                })
-                learning_patterns.extend(patterns.get('patterns', []))
-                
-                # Get knowledge gaps
-                gaps = await ai_study_features.identify_comprehension_gaps(
-                    doc['content'], 
-                    doc.get('quiz_results', [])
-                )
-                knowledge_gaps.extend(gaps.get('gaps', []))
+        for patterns, gaps in results:
+            learning_patterns.extend(patterns.get('patterns', []))
+            knowledge_gaps.extend(gaps.get('gaps', []))
         
         # Generate recommendations
         if user_documents:
+            ai_study_features = await get_ai_study_features()
             recommendations = await ai_study_features.generate_study_recommendations(
                 user_id, user_documents
             )
@@ -83,12 +271,12 @@ async def get_ai_insights_dashboard(user_id: str = "anonymous"):
             max(0, 50 - len(knowledge_gaps) * 5)
         ))
         
-        return {
+        dashboard = {
             "study_efficiency": {
                 "score": efficiency_score,
                 "trend": "improving" if efficiency_score > 70 else "stable",
                 "insights": [
-                    f"Analyzed {len(user_documents)} documents",
+                    f"Analyzed {len(analyzed_documents)} documents",
                     f"Identified {len(learning_patterns)} learning patterns",
                     f"Found {len(knowledge_gaps)} areas for improvement"
                 ]
@@ -98,6 +286,9 @@ async def get_ai_insights_dashboard(user_id: str = "anonymous"):
             "recommendations": recommendations[:5]  # Limit to top 5
         }
         
+        dashboard_cache.set(cache_key, dashboard)
+        return dashboard
+        
     except Exception as e:
         logger.error(f"Error getting AI insights dashboard: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get AI insights: {str(e)}")
@@ -106,6 +297,7 @@ async def get_ai_insights_dashboard(user_id: str = "anonymous"):
 async def analyze_study_pattern(request: LearningPatternRequest):
     """Analyze learning patterns from quiz results"""
     try:
+        ai_study_features = await get_ai_study_features()
         analysis = await ai_study_features.analyze_learning_patterns({
             'quiz_results': request.quiz_results,
             'user_id': request.user_id
@@ -120,14 +312,15 @@ async def generate_study_plan(request: StudyPlanRequest):
     """Generate adaptive study plan"""
     try:
         # Get document content
-        documents_collection = get_document_collection()
-        document = documents_collection.find_one({"_id": request.document_id})
+        db = await get_database()
+        document = await db.documents.find_one({"_id": request.document_id})
         
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
+        ai_study_features = await get_ai_study_features()
         study_plan = await ai_study_features.create_adaptive_study_plan(
-            document['content'], 
+            await load_document_content(document), 
             request.study_goals, 
             request.time_available
         )
@@ -142,6 +335,7 @@ async def generate_study_plan(request: StudyPlanRequest):
 async def get_realtime_assistance(request: RealtimeAssistanceRequest):
     """Get real-time study assistance"""
     try:
+        ai_study_features = await get_ai_study_features()
         assistance = await ai_study_features.provide_realtime_assistance(
             request.question, 
             request.context
@@ -156,14 +350,15 @@ async def analyze_document_intelligence(request: StudyAnalysisRequest):
     """Analyze document with smart processing"""
     try:
         # Get document content
-        documents_collection = get_document_collection()
-        document = documents_collection.find_one({"_id": request.document_id})
+        db = await get_database()
+        document = await db.documents.find_one({"_id": request.document_id})
         
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
+        smart_processor = await get_smart_processor()
         analysis = await smart_processor.analyze_document_for_study(
-            document['content']
+            await load_document_content(document)
         )
         return analysis
     except HTTPException:
@@ -176,17 +371,29 @@ async def analyze_document_intelligence(request: StudyAnalysisRequest):
 async def get_study_recommendations(user_id: str = "anonymous"):
     """Get personalized study recommendations"""
     try:
+        db = await get_database()
+        documents_collection = db.documents
+        
+        # Serve the cached payload while the user's documents are unchanged
+        cache_key = (user_id, await get_user_fingerprint(documents_collection, user_id))
+        cached = recommendations_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         # Get user's documents
-        documents_collection = get_document_collection()
-        user_documents = list(documents_collection.find({"user_id": user_id}))
+        user_documents = await documents_collection.find({"user_id": user_id}).to_list(length=None)
         
         if not user_documents:
-            return {"recommendations": []}
+            result = {"recommendations": []}
+        else:
+            ai_study_features = await get_ai_study_features()
+            recommendations = await ai_study_features.generate_study_recommendations(
+                user_id, user_documents
+            )
+            result = {"recommendations": recommendations}
         
-        recommendations = await ai_study_features.generate_study_recommendations(
-            user_id, user_documents
-        )
-        return {"recommendations": recommendations}
+        recommendations_cache.set(cache_key, result)
+        return result
         
     except Exception as e:
         logger.error(f"Error getting study recommendations: {str(e)}")
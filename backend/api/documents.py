@@ -1,45 +1,19 @@
-from fastapi import Request
+from models.document import FlashcardGenerationRequest
 # Endpoint to generate flashcards for a document (for frontend compatibility)
 @router.post("/flashcards/generate")
-async def generate_flashcards_api(request: Request):
+async def generate_flashcards_api(flashcard_request: FlashcardGenerationRequest):
     """
     Generate flashcards for a document by document_id (expects JSON: {"document_id": ...})
     """
     try:
-        data = await request.json()
-        document_id = data.get("document_id")
-        if not document_id:
-            raise HTTPException(status_code=400, detail="Missing document_id")
-        # Call the existing logic
-        return await generate_flashcards_from_document(document_id)
+        # Body parsing and validation happen in pydantic-core; a missing
+        # document_id is rejected with 422 before reaching this handler
+        return await generate_flashcards_from_document(flashcard_request.document_id)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in /flashcards/generate: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to generate flashcards")
-from bson import ObjectId
-from datetime import datetime
-
-# Comprehensive recursive serialization function
-def serialize_value(value):
-    """Recursively serialize any value, converting ObjectId and datetime to strings"""
-    if value is None:
-        return None
-    if isinstance(value, ObjectId):
-        return str(value)
-    if isinstance(value, datetime):
-        return value.isoformat()
-    if isinstance(value, dict):
-        return {k: serialize_value(v) for k, v in value.items()}
-    if isinstance(value, list):
-        return [serialize_value(item) for item in value]
-    return value
-
-# Helper function to serialize MongoDB documents
-def serialize_doc(doc):
-    if not doc:
-        return doc
-    return serialize_value(dict(doc))
 # Endpoint to get all due flashcards (for demo, returns all flashcards for all documents)
 @router.get("/flashcards/due")
 async def get_due_flashcards():
@@ -47,40 +21,189 @@ async def get_due_flashcards():
     Return all flashcards for all documents (simulate 'due' logic).
     """
     try:
-        db = await get_database()
-        documents_collection = db.documents
-        cursor = documents_collection.find({"flashcards": {"$exists": True, "$ne": []}})
-        documents = await cursor.to_list(length=None)
-        due_flashcards = []
-        for doc in documents:
-            doc = serialize_doc(doc)
-            doc_id = doc.get("_id") or doc.get("id", "")
-            for card in doc.get("flashcards", []):
-                # Add document id to each card for reference
-                card_copy = dict(card)
-                card_copy["document_id"] = doc_id
-                due_flashcards.append(card_copy)
-        return {"flashcards": due_flashcards}
+        documents_collection = get_collection("documents")
+        # Flatten cards and tag them with their document id inside MongoDB
+        cursor = documents_collection.aggregate(
+            DUE_FLASHCARDS_PIPELINE,
+            batchSize=DUE_FLASHCARDS_BATCH_SIZE
+        )
+        # Fetch the first batch up front so query failures still return a 500,
+        # then stream the rest as it arrives
+        first_batch = await cursor.to_list(length=DUE_FLASHCARDS_BATCH_SIZE)
+        return StreamingResponse(
+            stream_json_list("flashcards", first_batch, cursor, DUE_FLASHCARDS_BATCH_SIZE),
+            media_type="application/json"
+        )
     except Exception as e:
         logger.error(f"Error fetching due flashcards: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch due flashcards")
 # Document Upload and Processing API Routes
 # Handles file uploads, content extraction, and AI analysis
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Request, Query
+from fastapi.responses import Response, StreamingResponse
+from core.responses import dumps
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import asyncio
+import codecs
 import logging
+import os
+import aiofiles
+import aiofiles.tempfile
+from pymongo import ReturnDocument
 
-from services.llama_service import llama_ai_service
-from core.database import get_database
+try:
+    import magic
+except ImportError:
+    magic = None
+
+from services.llama_service import CHAT_TEMPLATE_TOKENS, llama_ai_service, generation_batcher
+from services.response_parsers import FlashcardStreamParser, parse_flashcards_response, parse_study_set_response
+from core.config import get_settings
+from core.cache import make_etag, etag_matches
+from core.database import (
+    get_collection,
+    store_document_content,
+    load_document_content,
+    delete_document_content,
+    to_mongo_id
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+settings = get_settings()
+
 router = APIRouter(prefix="/documents", tags=["Document Processing"])
 
+# Document parsing is CPU bound, so it runs in worker processes
+# instead of sharing the event loop with request handling
+document_executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+
+# Upload limits
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50MB
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Stream uploads to disk 64KB at a time
+MIME_SNIFF_SIZE = 512
+
+# Upload types the document processor can extract, keyed by detected MIME type
+PDF_MIME = "application/pdf"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+PPTX_MIME = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+TEXT_MIME = "text/plain"
+ALLOWED_MIME_TYPES = {PDF_MIME, DOCX_MIME, PPTX_MIME, TEXT_MIME}
+# DOCX and PPTX are both zip containers; the extension decides which one it is
+OOXML_MIME_BY_EXTENSION = {".docx": DOCX_MIME, ".pptx": PPTX_MIME}
+
+# Flashcard generation prompt and token budgets
+FLASHCARD_PROMPT_TEMPLATE = """
+        Create 20 flashcards from this content. Format each as:
+        Q: [Question]
+        A: [Answer]
+        
+        Focus on key concepts, definitions, and important facts.
+        
+        Content:
+        {content}
+        """
+FLASHCARD_RESPONSE_TOKENS = 2000
+PROMPT_CONTENT_TOKENS = 1024  # Content budget for document prompts, roughly the old 4000-character cap
+
+# Flashcards and quiz questions generated together at upload time, so the
+# document content is only sent through the model once
+STUDY_SET_PROMPT_TEMPLATE = """
+        Create 20 flashcards and 10 multiple-choice quiz questions from this content.
+        Respond with JSON only, using this schema:
+        {{"flashcards": [{{"question": "...", "answer": "..."}}],
+          "questions": [{{"question": "...", "options": ["...", "...", "...", "..."],
+                         "correct_answer": "...", "explanation": "..."}}]}}
+        
+        Focus on key concepts, definitions, and important facts.
+        
+        Content:
+        {content}
+        """
+STUDY_SET_RESPONSE_TOKENS = 3000
+
+# Quiz questions on their own, for the study pack; it shares the flashcard
+# output budget so both prompts can run in the same batched forward pass
+QUIZ_QUESTIONS_PROMPT_TEMPLATE = """
+        Create 10 multiple-choice quiz questions from this content.
+        Respond with JSON only, using this schema:
+        {{"questions": [{{"question": "...", "options": ["...", "...", "...", "..."],
+                         "correct_answer": "...", "explanation": "..."}}]}}
+        
+        Focus on key concepts, definitions, and important facts.
+        
+        Content:
+        {content}
+        """
+
+@lru_cache(maxsize=None)
+def template_tokens(template: str) -> int:
+    """Token count of a prompt template, computed once the tokenizer is loaded"""
+    return llama_ai_service.count_tokens(template)
+
+def array_size(field: str) -> Dict[str, Any]:
+    """Aggregation expression counting an array field, treating missing as empty"""
+    return {"$size": {"$cond": [{"$isArray": f"${field}"}, f"${field}", []]}}
+
+# Card and question counts are derived from the arrays by MongoDB rather
+# than stored alongside them
+FLASHCARD_COUNT = array_size("flashcards")
+QUESTION_COUNT = array_size("questions")
+
+# List-view shape, built by MongoDB so large payloads (content, flashcards,
+# questions) never leave the database
+LIST_VIEW_PROJECTION = {
+    "_id": 0,
+    "id": {"$toString": "$_id"},
+    "filename": 1,
+    "file_type": 1,
+    "file_size": 1,
+    "processed": 1,
+    "processing_status": 1,
+    "status": 1,
+    "summary": 1,
+    "flashcard_count": FLASHCARD_COUNT,
+    "question_count": QUESTION_COUNT,
+    "error": 1,
+    "upload_date": {
+        "$cond": [
+            {"$eq": [{"$type": "$upload_date"}, "date"]},
+            {"$dateToString": {"date": "$upload_date", "format": "%Y-%m-%dT%H:%M:%S.%LZ"}},
+            "$upload_date"
+        ]
+    }
+}
+
+# Fields the status endpoint reads
+STATUS_PROJECTION = {
+    "filename": 1,
+    "processed": 1,
+    "processing_status": 1,
+    "status": 1,
+    "summary": 1,
+    "flashcard_count": FLASHCARD_COUNT,
+    "question_count": QUESTION_COUNT,
+    "error": 1
+}
+
+# Due flashcards are fetched and streamed to the client this many at a time
+DUE_FLASHCARDS_BATCH_SIZE = 500
+
+# Every stored flashcard with its document id, shaped by MongoDB so no
+# other document fields are sent
+DUE_FLASHCARDS_PIPELINE = [
+    {"$match": {"flashcards.0": {"$exists": True}}},
+    {"$project": {"flashcards": 1}},
+    {"$unwind": "$flashcards"},
+    {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$flashcards", {"document_id": "$_id"}]}}}
+]
+
 @router.post("/upload")
 async def upload_document(
     background_tasks: BackgroundTasks,
@@ -99,30 +222,51 @@ async def upload_document(
     try:
         logger.info(f"Processing upload: {file.filename}")
         
-        # Validate file size (max 50MB)
-        content = await file.read()
-        file_size = len(content)
+        # Stream the upload to a temp file, enforcing the size limit as we go
+        suffix = os.path.splitext(file.filename)[1]
+        tmp_path = None
+        file_size = 0
+        mime_type = None
         
-        if file_size > 50 * 1024 * 1024:
-            raise HTTPException(
-                status_code=413,
-                detail="File size too large. Maximum size is 50MB."
-            )
+        try:
+            # aiofiles runs the file I/O in a thread so large uploads never block the loop
+            async with aiofiles.tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+                tmp_path = tmp_file.name
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    if mime_type is None:
+                        # Reject unsupported or spoofed types before writing anything
+                        mime_type = sniff_mime_type(chunk, file.filename)
+                        if mime_type is None:
+                            raise HTTPException(
+                                status_code=415,
+                                detail="Unsupported file type. Supported: PDF, DOCX, PPTX, TXT."
+                            )
+                    file_size += len(chunk)
+                    if file_size > MAX_UPLOAD_SIZE:
+                        raise HTTPException(
+                            status_code=413,
+                            detail="File size too large. Maximum size is 50MB."
+                        )
+                    await tmp_file.write(chunk)
+            if mime_type is None:
+                raise HTTPException(status_code=400, detail="Uploaded file is empty")
+        except Exception:
+            if tmp_path:
+                await asyncio.to_thread(os.unlink, tmp_path)
+            raise
         
         # Generate document ID
         import uuid
         document_id = str(uuid.uuid4())
         
-        # Reset file pointer
-        await file.seek(0)
-        
         # Process document in background
         background_tasks.add_task(
             process_document_background,
             document_id,
             file.filename,
-            content,
-            file.content_type
+            tmp_path,
+            file_size,
+            mime_type
         )
         
         # Return immediate response with processing status
@@ -143,80 +287,146 @@ async def upload_document(
             detail=f"Upload failed: {str(e)}"
         )
 
-async def process_document_background(document_id: str, filename: str, content: bytes, content_type: str):
+def orjson_response(payload: Any, request: Optional[Request] = None) -> Response:
+    """Encode a payload with orjson, bypassing FastAPI's jsonable_encoder so
+    ObjectId and datetime values are converted in C rather than in Python
+
+    When the request is given, the response carries an ETag of the body and
+    collapses to 304 Not Modified if the client already holds it.
+    """
+    content = dumps(payload)
+    if request is None:
+        return Response(content=content, media_type="application/json")
+    
+    etag = make_etag(content)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=content, media_type="application/json", headers={"ETag": etag})
+
+async def stream_json_list(key: str, batch: List[Any], cursor, batch_size: int):
+    """Encode {key: [...]} incrementally, one cursor batch per chunk"""
+    yield b'{"' + key.encode() + b'":['
+    separator = b""
+    try:
+        while batch:
+            yield separator + b",".join(map(dumps, batch))
+            separator = b","
+            batch = await cursor.to_list(length=batch_size)
+    except Exception as e:
+        # Headers are already sent; the truncated body signals the failure
+        logger.error(f"Error streaming {key}: {str(e)}")
+        raise
+    yield b"]}"
+
+def sniff_mime_type(first_chunk: bytes, filename: str) -> Optional[str]:
+    """Detect an upload's MIME type from its leading bytes rather than the client header"""
+    head = first_chunk[:MIME_SNIFF_SIZE]
+    extension = os.path.splitext(filename)[1].lower()
+    
+    if magic is not None:
+        mime = magic.from_buffer(head, mime=True)
+    elif head.startswith(b"%PDF-"):
+        mime = PDF_MIME
+    elif head.startswith(b"PK\x03\x04"):
+        mime = "application/zip"
+    else:
+        try:
+            # Incremental decoding tolerates a character split at the sniff boundary
+            codecs.getincrementaldecoder("utf-8")().decode(head)
+            mime = TEXT_MIME if b"\x00" not in head else None
+        except UnicodeDecodeError:
+            mime = None
+    
+    if mime is None:
+        return None
+    if mime in ("application/zip", "application/octet-stream"):
+        return OOXML_MIME_BY_EXTENSION.get(extension)
+    if mime.startswith("text/"):
+        return TEXT_MIME
+    return mime if mime in ALLOWED_MIME_TYPES else None
+
+def process_file_in_worker(tmp_path: str, filename: str) -> Dict[str, Any]:
+    """Extract and analyze a document inside a worker process"""
+    from services.document_processor import document_processor
+    return asyncio.run(document_processor.process_file(tmp_path, filename))
+
+async def process_document_background(
+    document_id: str,
+    filename: str,
+    tmp_path: str,
+    file_size: int,
+    content_type: str
+):
     """Background task for document processing"""
+    # Resolved once, shared by the success and failure writes
+    documents_collection = get_collection("documents")
+    
     try:
         logger.info(f"Starting background processing for {filename}")
         
-        # Import here to avoid circular dependency
-        import tempfile
-        import os
+        # Process the document straight from the temp file written by the upload handler
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            document_executor,
+            process_file_in_worker,
+            tmp_path,
+            filename
+        )
         
-        # Get database connection
-        db = await get_database()
-        documents_collection = db.documents
+        logger.info(f"Successfully processed {filename}")
         
-        # Save to temporary file for processing
-        suffix = os.path.splitext(filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
+        # Keep the extracted text in GridFS; the document only holds a reference
+        content = result.get("content", "")
+        content_id = await store_document_content(filename, content)
         
-        try:
-            # Process the document
-            from services.document_processor import document_processor
-            result = await document_processor.process_file(tmp_path, filename)
-            
-            logger.info(f"Successfully processed {filename}")
-            
-            # Store document in MongoDB
-            document_data = {
-                "_id": document_id,
-                "id": document_id,
-                "filename": filename,
-                "file_type": content_type,
-                "file_size": len(content),
-                "upload_date": datetime.utcnow(),
-                "processed": True,
-                "processing_status": "completed",
-                "status": "ready",
-                "summary": result.get("summary", ""),
-                "flashcard_count": len(result.get("flashcards", [])),
-                "question_count": len(result.get("questions", [])),
-                "content": result.get("content", ""),
-                "flashcards": result.get("flashcards", []),
-                "questions": result.get("questions", []),
-                "error": None
-            }
-            
-            await documents_collection.update_one(
-                {"_id": document_id},
-                {"$set": document_data},
-                upsert=True
-            )
-            
-            logger.info(f"Document {document_id} saved to MongoDB")
-            
-        finally:
-            # Clean up temp file
+        # Generate whatever study material the processor did not, in one model call
+        flashcards = result.get("flashcards") or []
+        questions = result.get("questions") or []
+        if content and not (flashcards and questions):
             try:
-                os.unlink(tmp_path)
-            except:
-                pass
+                generated_flashcards, generated_questions = await generate_study_set(content)
+                flashcards = flashcards or generated_flashcards
+                questions = questions or generated_questions
+            except Exception as e:
+                logger.warning(f"Study set generation failed for {filename}: {str(e)}")
+        
+        # Store document in MongoDB
+        document_data = {
+            "_id": document_id,
+            "id": document_id,
+            "filename": filename,
+            "file_type": content_type,
+            "file_size": file_size,
+            "upload_date": datetime.utcnow(),
+            "processed": True,
+            "processing_status": "completed",
+            "status": "ready",
+            "summary": result.get("summary", ""),
+            "content_id": content_id,
+            "content_length": len(content),
+            "flashcards": flashcards,
+            "questions": questions,
+            "error": None
+        }
+        
+        await documents_collection.update_one(
+            {"_id": document_id},
+            {"$set": document_data},
+            upsert=True
+        )
+        
+        logger.info(f"Document {document_id} saved to MongoDB")
         
     except Exception as e:
         logger.error(f"Background processing error: {str(e)}")
         
         # Store error in MongoDB
-        db = await get_database()
-        documents_collection = db.documents
-        
         error_data = {
             "_id": document_id,
             "id": document_id,
             "filename": filename,
             "file_type": content_type,
-            "file_size": len(content),
+            "file_size": file_size,
             "upload_date": datetime.utcnow(),
             "processed": False,
             "processing_status": "failed",
@@ -229,6 +439,13 @@ async def process_document_background(document_id: str, filename: str, content:
             {"$set": error_data},
             upsert=True
         )
+    
+    finally:
+        # Clean up temp file
+        try:
+            await asyncio.to_thread(os.unlink, tmp_path)
+        except OSError:
+            pass
 
 
 
@@ -238,10 +455,14 @@ async def get_processing_status(document_id: str):
     Get processing status for an uploaded document
     """
     try:
-        db = await get_database()
-        documents_collection = db.documents
+        documents_collection = get_collection("documents")
         
-        doc = await documents_collection.find_one({"_id": document_id})
+        status = await documents_collection.aggregate([
+            {"$match": {"_id": document_id}},
+            {"$limit": 1},
+            {"$project": STATUS_PROJECTION}
+        ]).to_list(length=1)
+        doc = status[0] if status else None
         
         if not doc:
             raise HTTPException(
@@ -271,32 +492,35 @@ async def get_processing_status(document_id: str):
         )
 
 @router.get("")
-async def list_user_documents():
+async def list_user_documents(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100)
+):
     """
-    List all uploaded documents from MongoDB
+    List uploaded documents from MongoDB, newest first, one page at a time
     """
     try:
-        db = await get_database()
-        documents_collection = db.documents
-        
-        # Get all documents from MongoDB, sorted by upload date (newest first)
-        cursor = documents_collection.find({}).sort("upload_date", -1)
-        documents = await cursor.to_list(length=None)
-        
-        # Convert ObjectId to string and format dates
-        for doc in documents:
-            doc["id"] = str(doc.get("_id", doc.get("id", "")))
-            if "_id" in doc:
-                del doc["_id"]
-            
-            # Convert datetime to ISO string if needed
-            if isinstance(doc.get("upload_date"), datetime):
-                doc["upload_date"] = doc["upload_date"].isoformat()
+        documents_collection = get_collection("documents")
         
-        return {
+        # Page and reshape documents server-side; the page arrives in a single
+        # batch and is consumed as it is decoded
+        cursor = documents_collection.aggregate([
+            {"$sort": {"upload_date": -1}},
+            {"$skip": skip},
+            {"$limit": limit},
+            {"$project": LIST_VIEW_PROJECTION}
+        ], batchSize=limit)
+        documents = [doc async for doc in cursor]
+        
+        total = await documents_collection.estimated_document_count()
+        
+        return orjson_response({
             "documents": documents,
-            "total": len(documents)
-        }
+            "total": total,
+            "skip": skip,
+            "limit": limit
+        }, request)
         
     except Exception as e:
         logger.error(f"Document list error: {str(e)}")
@@ -316,10 +540,12 @@ async def generate_quiz_from_document(
     Generate a quiz from an uploaded document using LLaMA 3.2
     """
     try:
-        db = await get_database()
-        documents_collection = db.documents
+        documents_collection = get_collection("documents")
         
-        doc = await documents_collection.find_one({"_id": document_id})
+        doc = await documents_collection.find_one(
+            {"_id": document_id},
+            {"processed": 1, "questions": 1, "content_id": 1}
+        )
         
         if not doc:
             raise HTTPException(
@@ -333,16 +559,16 @@ async def generate_quiz_from_document(
                 detail="Document is still processing"
             )
         
-        # Check if quiz already exists
-        if doc.get("questions") and len(doc.get("questions", [])) > 0:
-            return {
+        # Check if quiz already exists; stored questions are returned as-is
+        if doc.get("questions"):
+            return orjson_response({
                 "message": "Quiz already exists",
                 "document_id": document_id,
-                "questions": doc.get("questions", [])
-            }
+                "questions": doc["questions"]
+            })
         
         # Generate quiz using LLaMA
-        content = doc.get("content", "")
+        content = await fetch_document_content(documents_collection, doc)
         
         quiz_data = await llama_ai_service.generate_quiz_from_content(
             content=content,
@@ -352,20 +578,27 @@ async def generate_quiz_from_document(
         
         questions = quiz_data.get("questions", [])
         
-        # Update document in MongoDB with quiz
-        await documents_collection.update_one(
-            {"_id": document_id},
-            {"$set": {
-                "questions": questions,
-                "question_count": len(questions)
-            }}
+        # Store the quiz only if no concurrent request stored one first
+        updated = await documents_collection.find_one_and_update(
+            {"_id": document_id, "processed": True, "questions.0": {"$exists": False}},
+            {"$set": {"questions": questions}},
+            projection={"questions": 1},
+            return_document=ReturnDocument.AFTER
         )
         
-        return {
+        if not updated:
+            existing = await documents_collection.find_one({"_id": document_id}, {"questions": 1})
+            return orjson_response({
+                "message": "Quiz already exists",
+                "document_id": document_id,
+                "questions": (existing or {}).get("questions", [])
+            })
+        
+        return orjson_response({
             "message": "Quiz generated successfully",
             "document_id": document_id,
             "questions": questions
-        }
+        })
         
     except HTTPException:
         raise
@@ -378,24 +611,20 @@ async def generate_quiz_from_document(
 
 
 
-@router.post("/{document_id}/flashcards")
-async def generate_flashcards_from_document(
-    document_id: str
-):
+@router.post("/{document_id}/study-pack")
+async def generate_study_pack(document_id: str):
     """
-    Generate flashcards from an uploaded document using LLaMA 3.2
+    Return a document's flashcards and quiz together, generating whatever is
+    missing concurrently
     """
     try:
-        db = await get_database()
-        documents_collection = db.documents
+        documents_collection = get_collection("documents")
+        mongo_id = to_mongo_id(document_id)
         
-        # Always use ObjectId for MongoDB queries
-        from bson import ObjectId as BsonObjectId
-        try:
-            mongo_id = BsonObjectId(document_id)
-        except Exception:
-            mongo_id = document_id
-        doc = await documents_collection.find_one({"_id": mongo_id})
+        doc = await documents_collection.find_one(
+            {"_id": mongo_id},
+            {"processed": 1, "flashcards": 1, "questions": 1, "content_id": 1}
+        )
         
         if not doc:
             raise HTTPException(
@@ -409,57 +638,110 @@ async def generate_flashcards_from_document(
                 detail="Document is still processing"
             )
         
-        # Check if flashcards already exist
-        if doc.get("flashcards") and len(doc.get("flashcards", [])) > 0:
-            # Serialize the flashcards
-            flashcards = serialize_value(doc.get("flashcards", []))
-            return {
+        flashcards = doc.get("flashcards") or []
+        questions = doc.get("questions") or []
+        generated = not (flashcards and questions)
+        
+        if generated:
+            content = await fetch_document_content(documents_collection, doc)
+            
+            # Whatever is missing is generated as concurrent prompts the batcher can share a pass for
+            generated_flashcards, generated_questions = await asyncio.gather(
+                generate_missing(flashcards, generate_flashcard_set, content),
+                generate_missing(questions, generate_question_set, content)
+            )
+            
+            # Fill only the arrays that are still empty, in one atomic update,
+            # so a concurrent request's results are kept rather than overwritten
+            updated = await documents_collection.find_one_and_update(
+                {"_id": mongo_id},
+                [{"$set": {
+                    "flashcards": {"$cond": [
+                        {"$gt": [FLASHCARD_COUNT, 0]},
+                        "$flashcards",
+                        {"$literal": generated_flashcards}
+                    ]},
+                    "questions": {"$cond": [
+                        {"$gt": [QUESTION_COUNT, 0]},
+                        "$questions",
+                        {"$literal": generated_questions}
+                    ]}
+                }}],
+                projection={"flashcards": 1, "questions": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            flashcards = (updated or {}).get("flashcards") or generated_flashcards
+            questions = (updated or {}).get("questions") or generated_questions
+        
+        return orjson_response({
+            "message": "Study pack generated successfully" if generated else "Study pack already exists",
+            "document_id": document_id,
+            "flashcards": flashcards,
+            "questions": questions
+        })
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Study pack generation error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to generate study pack: {str(e)}"
+        )
+
+
+
+@router.post("/{document_id}/flashcards")
+async def generate_flashcards_from_document(
+    document_id: str
+):
+    """
+    Generate flashcards from an uploaded document using LLaMA 3.2
+    """
+    try:
+        documents_collection = get_collection("documents")
+        
+        mongo_id, doc = await get_flashcard_source(documents_collection, document_id)
+        
+        # Check if flashcards already exist; stored cards are returned as-is
+        if doc.get("flashcards"):
+            flashcards = doc["flashcards"]
+            return orjson_response({
                 "message": "Flashcards already exist",
                 "document_id": document_id,
                 "flashcards": flashcards,
                 "total": len(flashcards)
-            }
+            })
         
         # Generate flashcards using LLaMA
-        content = doc.get("content", "")
-        
-        flashcard_prompt = f"""
-        Create 20 flashcards from this content. Format each as:
-        Q: [Question]
-        A: [Answer]
-        
-        Focus on key concepts, definitions, and important facts.
-        
-        Content:
-        {content[:4000]}
-        """
-        
-        response = await llama_ai_service.generate_response(
-            prompt=flashcard_prompt,
-            context="flashcard_generation",
-            max_tokens=2000
+        flashcards = await generate_flashcard_set(
+            await fetch_document_content(documents_collection, doc)
         )
         
-        # Parse flashcards
-        flashcards = parse_flashcards_response(response)
+        # Store the flashcards only if no concurrent request stored some first
+        updated = await documents_collection.find_one_and_update(
+            {"_id": mongo_id, "processed": True, "flashcards.0": {"$exists": False}},
+            {"$set": {"flashcards": flashcards}},
+            projection={"flashcards": 1},
+            return_document=ReturnDocument.AFTER
+        )
         
-        # Update document in MongoDB with flashcards
-        await documents_collection.update_one(
-            {"_id": mongo_id},
-            {"$set": {
+        if not updated:
+            existing = await documents_collection.find_one({"_id": mongo_id}, {"flashcards": 1})
+            flashcards = (existing or {}).get("flashcards", [])
+            return orjson_response({
+                "message": "Flashcards already exist",
+                "document_id": document_id,
                 "flashcards": flashcards,
-                "flashcard_count": len(flashcards)
-            }}
-        )
+                "total": len(flashcards)
+            })
         
-        # Serialize the flashcards before returning
-        clean_flashcards = serialize_value(flashcards)
-        return {
+        return orjson_response({
             "message": "Flashcards generated successfully",
             "document_id": document_id,
-            "flashcards": clean_flashcards,
-            "total": len(clean_flashcards)
-        }
+            "flashcards": flashcards,
+            "total": len(flashcards)
+        })
         
     except HTTPException:
         raise
@@ -472,38 +754,137 @@ async def generate_flashcards_from_document(
 
 
 
-def parse_flashcards_response(response: str) -> List[Dict[str, str]]:
-    """Parse flashcards from LLaMA response"""
-    flashcards = []
-    lines = response.split('\n')
-    current_question = ""
-    current_answer = ""
+@router.post("/{document_id}/flashcards/stream")
+async def stream_flashcards_from_document(
+    document_id: str
+):
+    """
+    Generate flashcards as Server-Sent Events, emitting each card as soon as
+    the model finishes writing it
+    """
+    documents_collection = get_collection("documents")
     
-    for line in lines:
-        line = line.strip()
-        if line.startswith('Q:'):
-            if current_question and current_answer:
-                flashcards.append({
-                    'front': current_question,
-                    'back': current_answer,
-                    'difficulty': 'medium',
-                    'created_at': datetime.utcnow().isoformat()
-                })
-            current_question = line[2:].strip()
-            current_answer = ""
-        elif line.startswith('A:'):
-            current_answer = line[2:].strip()
+    mongo_id, doc = await get_flashcard_source(documents_collection, document_id)
     
-    # Add the last flashcard
-    if current_question and current_answer:
-        flashcards.append({
-            'front': current_question,
-            'back': current_answer,
-            'difficulty': 'medium',
-            'created_at': datetime.utcnow().isoformat()
-        })
+    async def event_stream():
+        try:
+            # Replay stored flashcards instead of regenerating them
+            if doc.get("flashcards"):
+                flashcards = doc["flashcards"]
+                for card in flashcards:
+                    yield format_sse(card)
+                yield format_sse({"total": len(flashcards), "generated": False}, event="done")
+                return
+            
+            flashcard_prompt = await build_flashcard_prompt(
+                await fetch_document_content(documents_collection, doc)
+            )
+            parser = FlashcardStreamParser()
+            flashcards = []
+            
+            async for text in llama_ai_service.generate_response_stream(
+                prompt=flashcard_prompt,
+                max_tokens=FLASHCARD_RESPONSE_TOKENS
+            ):
+                for card in parser.feed(text):
+                    flashcards.append(card)
+                    yield format_sse(card)
+            
+            for card in parser.close():
+                flashcards.append(card)
+                yield format_sse(card)
+            
+            # Store the flashcards only if no concurrent request stored some first
+            await documents_collection.find_one_and_update(
+                {"_id": mongo_id, "processed": True, "flashcards.0": {"$exists": False}},
+                {"$set": {"flashcards": flashcards}},
+                projection={"_id": 1}
+            )
+            
+            yield format_sse({"total": len(flashcards), "generated": True}, event="done")
+            
+        except Exception as e:
+            logger.error(f"Flashcard streaming error: {str(e)}")
+            yield format_sse({"detail": "Failed to generate flashcards"}, event="error")
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+async def fetch_document_content(documents_collection, doc: Dict[str, Any]) -> str:
+    """Load a document's text only once it is about to be sent to the model"""
+    if not doc.get("content_id"):
+        # Older documents keep their text inline; fetch just that field
+        doc = await documents_collection.find_one({"_id": doc["_id"]}, {"content": 1}) or {}
+    return await load_document_content(doc)
+
+async def get_flashcard_source(documents_collection, document_id: str):
+    """Load the fields flashcard generation needs, rejecting missing or unprocessed documents"""
+    mongo_id = to_mongo_id(document_id)
+    doc = await documents_collection.find_one(
+        {"_id": mongo_id},
+        {"processed": 1, "flashcards": 1, "content_id": 1}
+    )
+    
+    if not doc:
+        raise HTTPException(
+            status_code=404,
+            detail="Document not found"
+        )
+    
+    if not doc.get("processed"):
+        raise HTTPException(
+            status_code=400,
+            detail="Document is still processing"
+        )
     
-    return flashcards
+    return mongo_id, doc
+
+async def build_prompt(template: str, content: str, response_tokens: int) -> str:
+    """Fill a prompt template, trimming content by tokens to fit the context window"""
+    if not llama_ai_service.initialized:
+        await llama_ai_service.initialize()
+    # The prompt must fit the model's input window on its own, and prompt
+    # plus response the full context window
+    content_budget = min(
+        PROMPT_CONTENT_TOKENS,
+        llama_ai_service.max_context_length - CHAT_TEMPLATE_TOKENS - template_tokens(template),
+        settings.llm_context_window
+        - template_tokens(template)
+        - response_tokens
+    )
+    return template.format(
+        content=llama_ai_service.truncate_to_tokens(content, content_budget)
+    )
+
+async def build_flashcard_prompt(content: str) -> str:
+    """Fill the flashcard template for a document's content"""
+    return await build_prompt(FLASHCARD_PROMPT_TEMPLATE, content, FLASHCARD_RESPONSE_TOKENS)
+
+async def generate_study_set(content: str):
+    """Generate flashcards and quiz questions for a document in a single model call"""
+    prompt = await build_prompt(STUDY_SET_PROMPT_TEMPLATE, content, STUDY_SET_RESPONSE_TOKENS)
+    response = await generation_batcher.generate(prompt, max_new_tokens=STUDY_SET_RESPONSE_TOKENS)
+    return parse_study_set_response(response)
+
+async def generate_flashcard_set(content: str) -> List[Dict[str, str]]:
+    """Generate flashcards for a document through the generation batcher"""
+    prompt = await build_flashcard_prompt(content)
+    response = await generation_batcher.generate(prompt, max_new_tokens=FLASHCARD_RESPONSE_TOKENS)
+    return parse_flashcards_response(response)
+
+async def generate_question_set(content: str) -> List[Dict[str, Any]]:
+    """Generate quiz questions for a document through the generation batcher"""
+    prompt = await build_prompt(QUIZ_QUESTIONS_PROMPT_TEMPLATE, content, FLASHCARD_RESPONSE_TOKENS)
+    response = await generation_batcher.generate(prompt, max_new_tokens=FLASHCARD_RESPONSE_TOKENS)
+    return parse_study_set_response(response)[1]
+
+async def generate_missing(existing: List[Dict[str, Any]], generate, content: str) -> List[Dict[str, Any]]:
+    """Return existing results, generating them only when there are none"""
+    return existing if existing else await generate(content)
+
+def format_sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Encode one Server-Sent Event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {dumps(data).decode()}\n\n"
 
 @router.delete("/{document_id}")
 async def delete_document(document_id: str):
@@ -511,17 +892,21 @@ async def delete_document(document_id: str):
     Delete a document and all associated data from MongoDB
     """
     try:
-        db = await get_database()
-        documents_collection = db.documents
+        documents_collection = get_collection("documents")
         
-        result = await documents_collection.delete_one({"_id": document_id})
+        deleted = await documents_collection.find_one_and_delete(
+            {"_id": document_id},
+            projection={"content_id": 1}
+        )
         
-        if result.deleted_count == 0:
+        if not deleted:
             raise HTTPException(
                 status_code=404,
                 detail="Document not found"
             )
         
+        await delete_document_content(deleted)
+        
         logger.info(f"Document {document_id} deleted from MongoDB")
         
         return {
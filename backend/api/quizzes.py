@@ -3,26 +3,120 @@
 
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 from fastapi.responses import JSONResponse
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Tuple
 from datetime import datetime
+import asyncio
+import hashlib
+import json
 import logging
+import re
+import uuid
+import orjson
 from pydantic import BaseModel
 
-from services.llama_service import llama_ai_service
+from core.cache import TTLCache
+from core.config import get_settings
+from core.database import get_database, load_document_content, to_mongo_id
+from core.responses import MongoJSONResponse
+from models.quiz import QuizOutput, QuizRequest
+from services.llama_service import llama_ai_service, generation_batcher
+from services.response_parsers import create_fallback_quiz, parse_grading_score, parse_quiz_response
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/quizzes", tags=["Quiz System"])
+router = APIRouter(prefix="/quizzes", tags=["Quiz System"], default_response_class=MongoJSONResponse)
+settings = get_settings()
 
-class QuizRequest(BaseModel):
-    topic: str
-    subject: str
-    difficulty: str = "medium"
-    num_questions: int = 10
-    question_types: List[str] = ["multiple_choice", "true_false", "short_answer"]
-    document_id: Optional[str] = None
+# Document text per (document_id, user_id); documents are not edited after processing
+document_content_cache = TTLCache(
+    maxsize=settings.document_content_cache_size,
+    ttl=settings.document_content_cache_ttl
+)
+
+# Guided decoding schema: the model can only emit JSON that validates as QuizOutput
+QUIZ_OUTPUT_SCHEMA = json.dumps(QuizOutput.model_json_schema())
+
+# Generation budgets: JSON envelope plus a fixed allowance per question
+QUIZ_BASE_TOKENS = 150
+QUIZ_TOKENS_PER_QUESTION = 120
+QUIZ_CONTENT_TOKENS = 1500
+
+# Quiz history fields; question and attempt counts are computed by MongoDB
+# instead of shipping the full question text for every quiz
+USER_QUIZ_PROJECTION = {
+    "_id": 0,
+    "quiz_id": 1,
+    "title": "$quiz_data.title",
+    "request_params": 1,
+    "created_at": 1,
+    "status": 1,
+    "content_based": "$analytics.content_based",
+    "question_count": {"$size": {"$ifNull": ["$quiz_data.questions", []]}},
+    "attempt_count": {"$size": {"$ifNull": ["$attempts", []]}}
+}
+
+# Quiz generation prompt, filled with str.format per request
+QUIZ_PROMPT_TEMPLATE = """
+        Create a comprehensive {difficulty}-level quiz about {topic} in {subject}.
+        
+        Requirements:
+        - Generate {num_questions} questions
+        - Include these question types: {question_types}
+        - Make questions challenging but fair
+        - Provide clear, correct answers with explanations
+        
+        {context_line}
+        
+        Format your response as JSON:
+        {{
+            "title": "Quiz title",
+            "description": "Brief description",
+            "questions": [
+                {{
+                    "id": "q1",
+                    "type": "multiple_choice",
+                    "question": "Question text",
+                    "options": ["A) option1", "B) option2", "C) option3", "D) option4"],
+                    "correct_answer": "B",
+                    "explanation": "Why this is correct",
+                    "difficulty": "easy|medium|hard",
+                    "points": 10,
+                    "concept": "Key concept being tested"
+                }}
+            ]
+        }}
+        
+        Ensure variety in question types and difficulty levels.
+        """
+QUIZ_CONTEXT_LINE = "Base the quiz on this content: {content}"
+
+# Question fields hidden from students while they take a quiz
+ANSWER_FIELDS = frozenset({"correct_answer", "explanation"})
+
+# Question types graded by comparing answers, without the model
+OBJECTIVE_QUESTION_TYPES = {"multiple_choice", "true_false"}
+CHOICE_LETTER_PATTERN = re.compile(r"^([A-Z])(?:[).:]|$)")
+
+# All free-form answers of a submission are graded in one prompt
+GRADING_PROMPT_TEMPLATE = """
+        Grade each student answer against its reference answer.
+        Respond with a JSON list only, one entry per item:
+        [{{"id": "...", "score": 0-100, "is_correct": true|false, "feedback": "...",
+          "strengths": ["..."], "areas_for_improvement": ["..."]}}]
+        
+        Items:
+        {items}
+        """
+GRADING_TOKENS_PER_ANSWER = 150
+UNGRADED_EVALUATION = {
+    "score": 0,
+    "is_correct": False,
+    "feedback": "This answer could not be evaluated automatically.",
+    "strengths": [],
+    "areas_for_improvement": []
+}
 
 class QuizSubmission(BaseModel):
     quiz_id: str
@@ -51,20 +145,14 @@ async def generate_quiz(
     try:
         logger.info(f"Generating quiz: {request.topic} for user {current_user.id}")
         
-        # Get document content if specified
-        content_context = ""
-        if request.document_id:
-            content_context = await get_document_content(request.document_id, current_user.id)
-        
-        # Generate quiz using LLaMA in background
-        quiz_id = f"quiz_{current_user.id}_{int(datetime.utcnow().timestamp())}"
+        # Generate quiz using LLaMA in background; document content is read there too
+        quiz_id = f"quiz_{uuid.uuid4().hex}"
         
         background_tasks.add_task(
             generate_quiz_background,
             quiz_id,
             request,
-            current_user.id,
-            content_context
+            current_user.id
         )
         
         return JSONResponse(
@@ -86,99 +174,146 @@ async def generate_quiz(
             detail=f"Failed to start quiz generation: {str(e)}"
         )
 
-async def generate_quiz_background(quiz_id: str, request: QuizRequest, user_id: str, content_context: str):
+def quiz_cache_key(request: QuizRequest, content_context: str) -> str:
+    """Hash the parts of a quiz request that determine the generated quiz"""
+    key = {
+        "topic": request.topic.strip().lower(),
+        "subject": request.subject.strip().lower(),
+        "difficulty": request.difficulty,
+        "num_questions": request.num_questions,
+        "types": sorted(request.question_types),
+        "doc_sha": hashlib.sha256(content_context.encode()).hexdigest() if content_context else None
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+async def generate_quiz_background(quiz_id: str, request: QuizRequest, user_id: str):
     """Background task for quiz generation"""
     try:
         logger.info(f"Starting background quiz generation for {quiz_id}")
         
-        # Build comprehensive prompt for LLaMA
-        quiz_prompt = f"""
-        Create a comprehensive {request.difficulty}-level quiz about {request.topic} in {request.subject}.
-        
-        Requirements:
-        - Generate {request.num_questions} questions
-        - Include these question types: {', '.join(request.question_types)}
-        - Make questions challenging but fair
-        - Provide clear, correct answers with explanations
-        
-        {f"Base the quiz on this content: {content_context[:2000]}" if content_context else "Use general knowledge about the topic."}
-        
-        Format your response as JSON:
-        {{
-            "title": "Quiz title",
-            "description": "Brief description",
-            "questions": [
-                {{
-                    "id": "q1",
-                    "type": "multiple_choice",
-                    "question": "Question text",
-                    "options": ["A) option1", "B) option2", "C) option3", "D) option4"],
-                    "correct_answer": "B",
-                    "explanation": "Why this is correct",
-                    "difficulty": "easy|medium|hard",
-                    "points": 10,
-                    "concept": "Key concept being tested"
-                }}
-            ]
-        }}
-        
-        Ensure variety in question types and difficulty levels.
-        """
+        db = await get_database()
         
-        # Generate quiz using LLaMA
-        quiz_response = await llama_ai_service.generate_response(
-            prompt=quiz_prompt,
-            context="quiz_generation",
-            max_tokens=3000,
-            temperature=0.4  # Lower temperature for structured output
-        )
+        # Status polling sees the quiz as generating from the start
+        await db.quizzes.insert_one({
+            "quiz_id": quiz_id,
+            "user_id": user_id,
+            "request_params": request.dict(),
+            "created_at": datetime.utcnow(),
+            "status": "generating"
+        })
         
-        # Parse the response
-        try:
-            quiz_data = parse_quiz_response(quiz_response, quiz_id, request)
-        except Exception as parse_error:
-            logger.error(f"Quiz parsing error: {str(parse_error)}")
-            quiz_data = create_fallback_quiz(quiz_id, request)
+        # Get document content if specified
+        content_context = ""
+        if request.document_id:
+            content_context = await get_document_content(request.document_id, user_id)
+        
+        # Reuse a quiz generated for an identical request instead of calling the model
+        # (hashing a whole document is CPU work, kept off the event loop)
+        cache_key = await asyncio.to_thread(quiz_cache_key, request, content_context)
+        template = await db.quiz_templates.find_one({"cache_key": cache_key}, {"quiz_data": 1})
+        if template:
+            quiz_data = template["quiz_data"]
+            quiz_data["metadata"] = {
+                **quiz_data.get("metadata", {}),
+                "quiz_id": quiz_id,
+                "from_template": True
+            }
+        else:
+            quiz_data = await generate_quiz_data(quiz_id, request, content_context)
+        
+        # One timestamp: a BSON date for MongoDB, its ISO form inside the quiz JSON
+        generated_at = datetime.utcnow()
+        quiz_data["metadata"]["generated_at"] = generated_at.isoformat()
+        
+        if not template and not quiz_data["metadata"].get("fallback"):
+            await db.quiz_templates.update_one(
+                {"cache_key": cache_key},
+                {"$setOnInsert": {
+                    "cache_key": cache_key,
+                    "quiz_data": quiz_data,
+                    "created_at": generated_at
+                }},
+                upsert=True
+            )
         
-        # Save to database
-        db = await get_database()
+        # Save to database, completing the generating stub
         quiz_record = {
-            "quiz_id": quiz_id,
-            "user_id": user_id,
             "quiz_data": quiz_data,
-            "request_params": request.dict(),
+            "student_quiz_data": build_student_quiz(quiz_data),
             "content_context": bool(content_context),
-            "created_at": datetime.utcnow(),
             "status": "ready",
             "attempts": [],
             "analytics": {
-                "generation_time": datetime.utcnow(),
+                "generation_time": generated_at,
                 "ai_generated": True,
                 "content_based": bool(content_context)
             }
         }
         
-        await db.quizzes.insert_one(quiz_record)
+        await db.quizzes.update_one({"quiz_id": quiz_id}, {"$set": quiz_record})
         
         logger.info(f"Quiz {quiz_id} generated successfully")
         
     except Exception as e:
         logger.error(f"Background quiz generation error: {str(e)}")
         
-        # Update status to failed
+        # Mark this task's own generating stub as failed; never touch another quiz
         db = await get_database()
         await db.quizzes.update_one(
-            {"quiz_id": quiz_id},
+            {"quiz_id": quiz_id, "user_id": user_id, "status": "generating"},
             {
                 "$set": {
                     "status": "failed",
                     "error": str(e),
                     "updated_at": datetime.utcnow()
                 }
-            },
-            upsert=True
+            }
         )
 
+async def generate_quiz_data(quiz_id: str, request: QuizRequest, content_context: str) -> Dict[str, Any]:
+    """Generate and parse a quiz with LLaMA"""
+    prompt_fields = {
+        "difficulty": request.difficulty,
+        "topic": request.topic,
+        "subject": request.subject,
+        "num_questions": request.num_questions,
+        "question_types": ", ".join(request.question_types)
+    }
+    
+    # Build comprehensive prompt for LLaMA
+    if content_context:
+        if not llama_ai_service.initialized:
+            await llama_ai_service.initialize()
+        # The content gets whatever the model's input window leaves after the
+        # instructions, so truncation never cuts the JSON format or chat header
+        instructions = QUIZ_PROMPT_TEMPLATE.format(context_line=QUIZ_CONTEXT_LINE.format(content=""), **prompt_fields)
+        content_budget = min(QUIZ_CONTENT_TOKENS, llama_ai_service.prompt_token_budget(instructions))
+        # Tokenizing a whole document would stall other requests on the event loop
+        content_context = await asyncio.to_thread(
+            llama_ai_service.truncate_to_tokens, content_context, content_budget
+        )
+        context_line = QUIZ_CONTEXT_LINE.format(content=content_context)
+    else:
+        context_line = "Use general knowledge about the topic."
+    quiz_prompt = QUIZ_PROMPT_TEMPLATE.format(context_line=context_line, **prompt_fields)
+    
+    # Generate quiz using LLaMA, batched with other concurrent quiz requests
+    quiz_response = await generation_batcher.generate(
+        quiz_prompt,
+        max_new_tokens=QUIZ_BASE_TOKENS + QUIZ_TOKENS_PER_QUESTION * request.num_questions,
+        temperature=0.4,  # Lower temperature for structured output
+        json_schema=QUIZ_OUTPUT_SCHEMA
+    )
+    
+    # Parse the response
+    try:
+        quiz_data = parse_quiz_response(quiz_response, quiz_id, request)
+    except Exception as parse_error:
+        logger.error(f"Quiz parsing error: {str(parse_error)}")
+        quiz_data = create_fallback_quiz(quiz_id, request)
+    
+    return quiz_data
+
 @router.get("/status/{quiz_id}")
 async def get_quiz_status(
     quiz_id: str,
@@ -227,10 +362,11 @@ async def get_quiz(
     try:
         db = await get_database()
         
-        quiz = await db.quizzes.find_one({
-            "quiz_id": quiz_id,
-            "user_id": current_user.id
-        })
+        # The answer-free view is stored at generation time
+        quiz = await db.quizzes.find_one(
+            {"quiz_id": quiz_id, "user_id": current_user.id},
+            {"_id": 0, "status": 1, "student_quiz_data": 1}
+        )
         
         if not quiz:
             raise HTTPException(status_code=404, detail="Quiz not found")
@@ -241,27 +377,13 @@ async def get_quiz(
                 detail=f"Quiz is not ready. Status: {quiz['status']}"
             )
         
-        # Return quiz without answers for taking
-        quiz_data = quiz["quiz_data"]
-        questions_for_taking = []
+        student_quiz = quiz.get("student_quiz_data")
+        if student_quiz is None:
+            # Quizzes saved before the stored view existed
+            legacy = await db.quizzes.find_one({"quiz_id": quiz_id}, {"_id": 0, "quiz_data": 1})
+            student_quiz = build_student_quiz(legacy["quiz_data"])
         
-        for question in quiz_data["questions"]:
-            question_copy = question.copy()
-            # Remove correct answer and explanation for quiz taking
-            question_copy.pop("correct_answer", None)
-            question_copy.pop("explanation", None)
-            questions_for_taking.append(question_copy)
-        
-        return {
-            "quiz_id": quiz_id,
-            "title": quiz_data["title"],
-            "description": quiz_data.get("description", ""),
-            "questions": questions_for_taking,
-            "total_questions": len(questions_for_taking),
-            "total_points": sum(q.get("points", 10) for q in quiz_data["questions"]),
-            "time_limit": quiz_data.get("time_limit"),
-            "instructions": quiz_data.get("instructions", "Answer all questions to the best of your ability.")
-        }
+        return {"quiz_id": quiz_id, **student_quiz}
         
     except HTTPException:
         raise
@@ -292,42 +414,38 @@ async def submit_quiz(
         if not quiz:
             raise HTTPException(status_code=404, detail="Quiz not found")
         
-        # Evaluate answers using LLaMA
-        evaluation_results = await evaluate_quiz_answers(
+        # Evaluate answers using LLaMA; scores and breakdowns come from the same pass
+        evaluation_results, analysis = await evaluate_quiz_answers(
             quiz["quiz_data"], 
             submission.answers,
             current_user.id
         )
         
-        # Calculate overall score
-        total_score = sum(result["score"] for result in evaluation_results["question_results"])
-        max_score = sum(q.get("points", 10) for q in quiz["quiz_data"]["questions"])
-        percentage = (total_score / max_score * 100) if max_score > 0 else 0
-        
         # Create attempt record
+        submitted_at = datetime.utcnow()
         attempt = {
-            "attempt_id": f"attempt_{current_user.id}_{int(datetime.utcnow().timestamp())}",
+            "attempt_id": f"attempt_{current_user.id}_{int(submitted_at.timestamp())}",
             "user_id": current_user.id,
             "quiz_id": submission.quiz_id,
-            "submitted_at": datetime.utcnow(),
+            "submitted_at": submitted_at,
             "answers": submission.answers,
             "evaluation": evaluation_results,
             "score": {
-                "points": total_score,
-                "max_points": max_score,
-                "percentage": round(percentage, 2)
+                "points": analysis["total_score"],
+                "max_points": analysis["max_score"],
+                "percentage": round(analysis["percentage"], 2)
             },
             "time_taken": None,  # Could be tracked on frontend
             "feedback_generated": True
         }
         
-        # Save attempt
-        await db.quiz_attempts.insert_one(attempt)
-        
-        # Update quiz with attempt reference
-        await db.quizzes.update_one(
-            {"quiz_id": submission.quiz_id},
-            {"$push": {"attempts": attempt["attempt_id"]}}
+        # Save attempt and update quiz with attempt reference in one round trip
+        await asyncio.gather(
+            db.quiz_attempts.insert_one(attempt),
+            db.quizzes.update_one(
+                {"quiz_id": submission.quiz_id},
+                {"$push": {"attempts": attempt["attempt_id"]}}
+            )
         )
         
         return {
@@ -335,8 +453,13 @@ async def submit_quiz(
             "quiz_id": submission.quiz_id,
             "score": attempt["score"],
             "evaluation": evaluation_results,
-            "performance_analysis": generate_performance_analysis(evaluation_results),
-            "next_steps": generate_learning_recommendations(evaluation_results, quiz["quiz_data"]),
+            "performance_analysis": {
+                "difficulty_breakdown": analysis["difficulty_breakdown"],
+                "concept_breakdown": analysis["concept_breakdown"],
+                "strengths": analysis["strengths"],
+                "areas_for_improvement": analysis["areas_for_improvement"]
+            },
+            "next_steps": generate_learning_recommendations(analysis["areas_for_improvement"]),
             "submitted_at": attempt["submitted_at"]
         }
         
@@ -400,28 +523,32 @@ async def get_user_quizzes(
     try:
         db = await get_database()
         
-        quizzes = await db.quizzes.find(
-            {"user_id": current_user.id}
-        ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit)
+        # Page and total count run concurrently
+        quizzes, total = await asyncio.gather(
+            db.quizzes.find(
+                {"user_id": current_user.id},
+                USER_QUIZ_PROJECTION
+            ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit),
+            db.quizzes.count_documents({"user_id": current_user.id})
+        )
         
+        # Generating and failed quizzes have no quiz data or analytics yet
         formatted_quizzes = []
         for quiz in quizzes:
-            quiz_data = quiz.get("quiz_data", {})
+            request_params = quiz.get("request_params") or {}
             formatted_quizzes.append({
                 "quiz_id": quiz["quiz_id"],
-                "title": quiz_data.get("title", "Untitled Quiz"),
-                "topic": quiz["request_params"]["topic"],
-                "subject": quiz["request_params"]["subject"],
-                "difficulty": quiz["request_params"]["difficulty"],
-                "question_count": len(quiz_data.get("questions", [])),
-                "created_at": quiz["created_at"],
-                "status": quiz["status"],
-                "attempt_count": len(quiz.get("attempts", [])),
-                "content_based": quiz["analytics"]["content_based"]
+                "title": quiz.get("title", "Untitled Quiz"),
+                "topic": request_params.get("topic"),
+                "subject": request_params.get("subject"),
+                "difficulty": request_params.get("difficulty"),
+                "question_count": quiz.get("question_count", 0),
+                "created_at": quiz.get("created_at"),
+                "status": quiz.get("status", "ready"),
+                "attempt_count": quiz.get("attempt_count", 0),
+                "content_based": quiz.get("content_based", False)
             })
         
-        total = await db.quizzes.count_documents({"user_id": current_user.id})
-        
         return {
             "quizzes": formatted_quizzes,
             "total": total,
@@ -476,47 +603,127 @@ async def delete_quiz(
 
 # Helper functions
 
-async def evaluate_quiz_answers(quiz_data: Dict, user_answers: Dict[str, str], user_id: str) -> Dict[str, Any]:
-    """Evaluate quiz answers using LLaMA AI"""
+async def evaluate_quiz_answers(
+    quiz_data: Dict,
+    user_answers: Dict[str, str],
+    user_id: str
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Evaluate quiz answers, grading objective questions directly and the rest
+    with one LLaMA call. Returns the evaluation and its performance analysis
+    """
+    questions = quiz_data["questions"]
     
-    question_results = []
+    evaluations = {}
+    to_grade = []
+    for question in questions:
+        user_answer = user_answers.get(question["id"], "")
+        if question.get("type") in OBJECTIVE_QUESTION_TYPES:
+            evaluations[question["id"]] = grade_objective_answer(question, user_answer)
+        elif not user_answer.strip():
+            evaluations[question["id"]] = unanswered_evaluation(question)
+        else:
+            to_grade.append(question)
     
-    for question in quiz_data["questions"]:
-        question_id = question["id"]
-        user_answer = user_answers.get(question_id, "")
-        correct_answer = question.get("correct_answer", "")
-        
-        # Use LLaMA to evaluate the answer
-        evaluation = await llama_ai_service.evaluate_answer(
-            question=question["question"],
-            student_answer=user_answer,
-            correct_answer=correct_answer,
-            content_context=""
-        )
-        
+    if to_grade:
+        evaluations.update(await grade_free_form_answers(to_grade, user_answers))
+    
+    question_results = []
+    for question in questions:
+        evaluation = evaluations[question["id"]]
         question_results.append({
-            "question_id": question_id,
+            "question_id": question["id"],
             "question": question["question"],
-            "user_answer": user_answer,
-            "correct_answer": correct_answer,
+            "user_answer": user_answers.get(question["id"], ""),
+            "correct_answer": question.get("correct_answer", ""),
             "evaluation": evaluation,
             "score": evaluation.get("score", 0) * question.get("points", 10) / 100,
             "max_score": question.get("points", 10)
         })
     
-    return {
+    analysis = analyze_quiz_results(question_results)
+    evaluation_results = {
         "question_results": question_results,
-        "overall_feedback": generate_overall_feedback(question_results),
+        "overall_feedback": generate_overall_feedback(analysis["percentage"]),
         "evaluated_at": datetime.utcnow().isoformat(),
-        "ai_evaluated": True
+        "ai_evaluated": bool(to_grade)
     }
+    return evaluation_results, analysis
 
-def generate_overall_feedback(question_results: List[Dict]) -> str:
-    """Generate overall quiz feedback"""
-    total_score = sum(result["score"] for result in question_results)
-    max_score = sum(result["max_score"] for result in question_results)
-    percentage = (total_score / max_score * 100) if max_score > 0 else 0
+def normalize_choice(answer: str) -> str:
+    """Reduce an answer like "b) option" or "True" to a comparable token"""
+    answer = answer.strip().upper()
+    match = CHOICE_LETTER_PATTERN.match(answer)
+    return match.group(1) if match else answer
+
+def grade_objective_answer(question: Dict, user_answer: str) -> Dict[str, Any]:
+    """Grade a multiple-choice or true/false answer by comparison, without the model"""
+    correct_answer = question.get("correct_answer", "")
+    is_correct = bool(user_answer.strip()) and normalize_choice(user_answer) == normalize_choice(correct_answer)
+    concept = question.get("concept")
+    return {
+        "score": 100 if is_correct else 0,
+        "is_correct": is_correct,
+        "feedback": "Correct!" if is_correct else f"The correct answer is {correct_answer}.",
+        "strengths": [concept] if is_correct and concept else [],
+        "areas_for_improvement": [concept] if not is_correct and concept else []
+    }
+
+def unanswered_evaluation(question: Dict) -> Dict[str, Any]:
+    """Evaluation for a question left blank"""
+    concept = question.get("concept")
+    return {
+        "score": 0,
+        "is_correct": False,
+        "feedback": "No answer was given.",
+        "strengths": [],
+        "areas_for_improvement": [concept] if concept else []
+    }
+
+async def grade_free_form_answers(questions: List[Dict], user_answers: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """Grade every free-form answer in a single LLaMA call"""
+    items = [
+        {
+            "id": question["id"],
+            "question": question["question"],
+            "reference_answer": question.get("correct_answer", ""),
+            "student_answer": user_answers.get(question["id"], "")
+        }
+        for question in questions
+    ]
+    prompt = GRADING_PROMPT_TEMPLATE.format(items=json.dumps(items, ensure_ascii=False))
     
+    graded = {}
+    try:
+        response = await generation_batcher.generate(
+            prompt,
+            max_new_tokens=GRADING_TOKENS_PER_ANSWER * len(items),
+            temperature=0.2
+        )
+        results = orjson.loads(response[response.index("["):response.rindex("]") + 1])
+        graded = {str(result.get("id")): result for result in results if isinstance(result, dict)}
+    except Exception as e:
+        logger.error(f"Answer grading error: {str(e)}")
+    
+    evaluations = {}
+    for question in questions:
+        result = graded.get(question["id"])
+        score = parse_grading_score(result.get("score")) if result is not None else None
+        if score is None:
+            evaluations[question["id"]] = dict(UNGRADED_EVALUATION)
+            continue
+        is_correct = result.get("is_correct")
+        evaluations[question["id"]] = {
+            "score": score,
+            "is_correct": is_correct if isinstance(is_correct, bool) else score >= 70,
+            "feedback": result.get("feedback", ""),
+            "strengths": result.get("strengths", []),
+            "areas_for_improvement": result.get("areas_for_improvement", [])
+        }
+    return evaluations
+
+def generate_overall_feedback(percentage: float) -> str:
+    """Generate overall quiz feedback"""
     if percentage >= 90:
         return "Excellent work! You demonstrated strong understanding of the material."
     elif percentage >= 80:
@@ -528,67 +735,53 @@ def generate_overall_feedback(question_results: List[Dict]) -> str:
     else:
         return "Consider reviewing the material more thoroughly before attempting similar quizzes."
 
-def generate_performance_analysis(evaluation_results: Dict) -> Dict[str, Any]:
-    """Generate detailed performance analysis"""
-    question_results = evaluation_results["question_results"]
-    
-    # Analyze by difficulty
+def analyze_quiz_results(question_results: List[Dict]) -> Dict[str, Any]:
+    """Score totals, strengths, weak areas and breakdowns in a single pass over the results"""
+    total_score = 0
+    max_score = 0
+    strengths = set()
+    areas = set()
     difficulty_performance = {}
     concept_performance = {}
     
     for result in question_results:
+        evaluation = result["evaluation"]
+        is_correct = evaluation.get("is_correct", False)
+        score = evaluation.get("score", 0)
+        total_score += result["score"]
+        max_score += result["max_score"]
+        
+        if is_correct and score >= 80:
+            strengths.update(evaluation.get("strengths", []))
+        if not is_correct or score < 70:
+            areas.update(evaluation.get("areas_for_improvement", []))
+        
         # This would require question difficulty info
         difficulty = "medium"  # Default
         concept = result.get("concept", "general")
         
-        if difficulty not in difficulty_performance:
-            difficulty_performance[difficulty] = {"correct": 0, "total": 0}
-        if concept not in concept_performance:
-            concept_performance[concept] = {"correct": 0, "total": 0}
-        
-        is_correct = result["evaluation"].get("is_correct", False)
-        difficulty_performance[difficulty]["total"] += 1
-        concept_performance[concept]["total"] += 1
-        
+        difficulty_stats = difficulty_performance.setdefault(difficulty, {"correct": 0, "total": 0})
+        concept_stats = concept_performance.setdefault(concept, {"correct": 0, "total": 0})
+        difficulty_stats["total"] += 1
+        concept_stats["total"] += 1
         if is_correct:
-            difficulty_performance[difficulty]["correct"] += 1
-            concept_performance[concept]["correct"] += 1
+            difficulty_stats["correct"] += 1
+            concept_stats["correct"] += 1
     
     return {
+        "total_score": total_score,
+        "max_score": max_score,
+        "percentage": (total_score / max_score * 100) if max_score > 0 else 0,
+        "strengths": list(strengths)[:3],
+        "areas_for_improvement": list(areas)[:3],
         "difficulty_breakdown": difficulty_performance,
-        "concept_breakdown": concept_performance,
-        "strengths": identify_strengths(question_results),
-        "areas_for_improvement": identify_improvement_areas(question_results)
+        "concept_breakdown": concept_performance
     }
 
-def identify_strengths(question_results: List[Dict]) -> List[str]:
-    """Identify student strengths from quiz results"""
-    strengths = []
-    for result in question_results:
-        if result["evaluation"].get("is_correct") and result["evaluation"].get("score", 0) >= 80:
-            strengths.extend(result["evaluation"].get("strengths", []))
-    
-    # Remove duplicates and return top strengths
-    return list(set(strengths))[:3]
-
-def identify_improvement_areas(question_results: List[Dict]) -> List[str]:
-    """Identify areas needing improvement"""
-    areas = []
-    for result in question_results:
-        if not result["evaluation"].get("is_correct") or result["evaluation"].get("score", 0) < 70:
-            areas.extend(result["evaluation"].get("areas_for_improvement", []))
-    
-    # Remove duplicates and return top areas
-    return list(set(areas))[:3]
-
-def generate_learning_recommendations(evaluation_results: Dict, quiz_data: Dict) -> List[str]:
+def generate_learning_recommendations(weak_areas: List[str]) -> List[str]:
     """Generate personalized learning recommendations"""
     recommendations = []
     
-    # Analyze performance
-    question_results = evaluation_results["question_results"]
-    weak_areas = identify_improvement_areas(question_results)
-    
     if weak_areas:
         recommendations.append(f"Focus on reviewing: {', '.join(weak_areas)}")
     
@@ -603,77 +796,44 @@ def generate_learning_recommendations(evaluation_results: Dict, quiz_data: Dict)
 
 async def get_document_content(document_id: str, user_id: str) -> str:
     """Get content from uploaded document"""
+    cache_key = (document_id, user_id)
+    cached = document_content_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
         db = await get_database()
-        from bson import ObjectId
         
-        document = await db.documents.find_one({
-            "_id": ObjectId(document_id),
-            "user_id": user_id
-        })
+        # Uploads have UUID string ids and no owner; their text lives in GridFS
+        document = await db.documents.find_one(
+            {"_id": to_mongo_id(document_id), "user_id": {"$in": [user_id, None]}},
+            {"content_id": 1, "content": 1}
+        )
         
         if document:
-            return document["content"]["text"]
+            content = await load_document_content(document)
+            # Documents still being processed have no text yet, so only cache real content
+            if content:
+                document_content_cache.set(cache_key, content)
+            return content
         return ""
         
     except Exception as e:
         logger.error(f"Document content retrieval error: {str(e)}")
         return ""
 
-def parse_quiz_response(response: str, quiz_id: str, request: QuizRequest) -> Dict[str, Any]:
-    """Parse quiz response from LLaMA"""
-    try:
-        import json
-        quiz_data = json.loads(response)
-        
-        # Ensure required fields
-        if "title" not in quiz_data:
-            quiz_data["title"] = f"{request.topic} Quiz"
-        if "questions" not in quiz_data:
-            quiz_data["questions"] = []
-        
-        # Add metadata
-        quiz_data["metadata"] = {
-            "quiz_id": quiz_id,
-            "generated_at": datetime.utcnow().isoformat(),
-            "ai_generated": True,
-            "topic": request.topic,
-            "subject": request.subject,
-            "difficulty": request.difficulty
-        }
-        
-        return quiz_data
-        
-    except json.JSONDecodeError:
-        # Fallback to structured parsing if JSON fails
-        return create_fallback_quiz(quiz_id, request)
-
-def create_fallback_quiz(quiz_id: str, request: QuizRequest) -> Dict[str, Any]:
-    """Create a basic fallback quiz when AI generation fails"""
+def build_student_quiz(quiz_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the quiz as shown to students, without answers or explanations"""
+    questions = [
+        {key: value for key, value in question.items() if key not in ANSWER_FIELDS}
+        for question in quiz_data["questions"]
+    ]
     return {
-        "title": f"{request.topic} Practice Quiz",
-        "description": f"Practice quiz covering {request.topic} concepts",
-        "questions": [
-            {
-                "id": f"q{i}",
-                "type": "multiple_choice",
-                "question": f"Question {i} about {request.topic}",
-                "options": ["A) Option 1", "B) Option 2", "C) Option 3", "D) Option 4"],
-                "correct_answer": "A",
-                "explanation": "This is a placeholder question generated due to AI processing error.",
-                "difficulty": request.difficulty,
-                "points": 10,
-                "concept": request.topic
-            }
-            for i in range(1, min(request.num_questions + 1, 6))  # Max 5 fallback questions
-        ],
-        "metadata": {
-            "quiz_id": quiz_id,
-            "generated_at": datetime.utcnow().isoformat(),
-            "ai_generated": False,
-            "fallback": True,
-            "topic": request.topic,
-            "subject": request.subject,
-            "difficulty": request.difficulty
-        }
-    }
\ No newline at end of file
+        "title": quiz_data["title"],
+        "description": quiz_data.get("description", ""),
+        "questions": questions,
+        "total_questions": len(questions),
+        "total_points": sum(q.get("points", 10) for q in quiz_data["questions"]),
+        "time_limit": quiz_data.get("time_limit"),
+        "instructions": quiz_data.get("instructions", "Answer all questions to the best of your ability.")
+    }
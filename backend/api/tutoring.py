@@ -3,24 +3,101 @@
 
 from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, StreamingResponse
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple
 from datetime import datetime
 import asyncio
-import json
+import hashlib
 import logging
 import uuid
+import orjson
+from pymongo import ReturnDocument, UpdateOne
 
-from services.llama_service import llama_ai_service
+from core.cache import TTLCache
+from core.config import get_settings
+from core.database import BulkWriteBatcher, get_collection
+from core.responses import MongoJSONResponse, dumps
+from services.llama_service import llama_ai_service, generation_batcher, DEFAULT_RELATED_CONCEPTS
+from services.response_parsers import parse_practice_problems
+from services.tutor_cache import normalize_prompt, tutor_cache
 from models.tutoring import TutoringRequest, TutoringResponse, TutoringSession
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/tutoring", tags=["AI Tutoring"])
+router = APIRouter(prefix="/tutoring", tags=["AI Tutoring"], default_response_class=MongoJSONResponse)
 
-# Active tutoring sessions
-active_sessions: Dict[str, Dict] = {}
+settings = get_settings()
+
+# Active tutoring sessions: per-session settings only, bounded per worker.
+# Conversation history lives in MongoDB alone and is appended with $push, so
+# workers never hold diverging copies of it
+active_sessions = TTLCache(
+    maxsize=settings.active_session_cache_size,
+    ttl=settings.active_session_cache_ttl
+)
+SESSION_PROJECTION = {
+    "_id": 0,
+    "session_id": 1,
+    "user_id": 1,
+    "topic": 1,
+    "subject": 1,
+    "difficulty": 1,
+    "document_context": 1,
+    "status": 1
+}
+
+# Session list fields; the history is only counted, never shipped
+SESSION_LIST_PROJECTION = {
+    "_id": 0,
+    "session_id": 1,
+    "topic": 1,
+    "subject": 1,
+    "difficulty": 1,
+    "started_at": 1,
+    "status": 1,
+    "learning_goals": 1,
+    "conversation_length": {"$size": {"$ifNull": ["$conversation_history", []]}}
+}
+
+# Turn appends from concurrent requests share bulk_write round trips
+session_writes = BulkWriteBatcher("tutoring_sessions")
+
+# Every tutor reply goes through the shared generation batcher, so concurrent
+# students are answered in batched forward passes rather than one at a time
+TUTOR_PROMPT_TEMPLATE = """
+        You are a patient, encouraging tutor helping a {difficulty}-level student with {topic} in {subject}.
+        Answer the student clearly and check their understanding.
+        {context}
+        {history}
+        Student: {message}
+        """
+TUTOR_CONTEXT_TOKENS = 512  # upper bound; the model's input window may leave less
+
+# Recent turns included in tutor prompts, each side trimmed to a few sentences
+TUTOR_HISTORY_TURNS = 3
+TUTOR_HISTORY_TURN_TOKENS = 96
+HISTORY_TURN_FIELDS = (("student_question", "tutor_response"), ("concept_request", "tutor_explanation"))
+
+# Explanation prompts by explanation type; only the chosen one is formatted
+EXPLANATION_PROMPTS = {
+    "simple": "Explain {concept} in {subject} in the simplest terms possible for a {difficulty} level student.",
+    "detailed": "Provide a comprehensive explanation of {concept} in {subject} with step-by-step breakdown for a {difficulty} level student.",
+    "examples": "Explain {concept} in {subject} using practical examples and real-world applications for a {difficulty} level student."
+}
+
+# Follow-up suggestions offered after every answer
+FOLLOW_UP_QUESTIONS = (
+    "Can you explain more about {topic}?",
+    "Can you give me another example?",
+    "How does this apply in real life?"
+)
+
+# Related concepts by (subject, normalized concept)
+related_concepts_cache = TTLCache(
+    maxsize=settings.related_concepts_cache_size,
+    ttl=settings.related_concepts_cache_ttl
+)
 
 @router.post("/start-session", response_model=TutoringResponse)
 async def start_tutoring_session(
@@ -50,11 +127,14 @@ async def start_tutoring_session(
         }
         
         # Save to database
-        db = await get_database()
-        await db.tutoring_sessions.insert_one(session)
+        sessions_collection = get_collection("tutoring_sessions")
+        await sessions_collection.insert_one(session)
         
         # Store in active sessions
-        active_sessions[session_id] = session
+        active_sessions.set(
+            session_id,
+            {field: session.get(field) for field, included in SESSION_PROJECTION.items() if included}
+        )
         
         # Generate welcome message using LLaMA
         welcome_prompt = f"""
@@ -72,11 +152,9 @@ async def start_tutoring_session(
         - Set a positive, learning-focused tone
         """
         
-        welcome_message = await llama_ai_service.tutor_conversation(
-            user_message="Start tutoring session",
-            user_id=current_user.id,
-            session_id=session_id,
-            content_context=request.document_context or ""
+        welcome_message = await tutor_conversation(
+            user_message=welcome_prompt,
+            session=session
         )
         
         return TutoringResponse(
@@ -105,54 +183,35 @@ async def ask_tutor_question(
     """
     try:
         # Verify session exists and belongs to user
-        if session_id not in active_sessions:
-            db = await get_database()
-            session = await db.tutoring_sessions.find_one({
-                "session_id": session_id,
-                "user_id": current_user.id
-            })
-            if not session:
-                raise HTTPException(status_code=404, detail="Session not found")
-            active_sessions[session_id] = session
-        
-        session = active_sessions[session_id]
-        
-        # Get document context if available
-        document_context = session.get("document_context", "")
+        session = await get_active_session(session_id, current_user.id)
         
         # Generate tutor response
-        response = await llama_ai_service.tutor_conversation(
+        response = await tutor_conversation(
             user_message=question,
-            user_id=current_user.id,
-            session_id=session_id,
-            content_context=document_context
+            session=session
         )
         
-        # Update session history
-        session["conversation_history"].append({
-            "student_question": question,
-            "tutor_response": response,
-            "timestamp": datetime.utcnow().isoformat()
-        })
-        
-        # Update in database
-        db = await get_database()
-        await db.tutoring_sessions.update_one(
+        # Update session history in database
+        sessions_collection = get_collection("tutoring_sessions")
+        updated = await sessions_collection.find_one_and_update(
             {"session_id": session_id},
             {
-                "$push": {"conversation_history": session["conversation_history"][-1]},
+                "$push": {"conversation_history": {
+                    "student_question": question,
+                    "tutor_response": response,
+                    "timestamp": datetime.utcnow().isoformat()
+                }},
                 "$set": {"last_activity": datetime.utcnow()}
-            }
+            },
+            projection={"_id": 0, "session_length": {"$size": "$conversation_history"}},
+            return_document=ReturnDocument.AFTER
         )
         
-        # Generate follow-up suggestions
-        follow_ups = await generate_follow_up_questions(question, response, session["topic"])
-        
         return {
             "session_id": session_id,
             "response": response,
-            "follow_up_questions": follow_ups,
-            "session_length": len(session["conversation_history"]),
+            "follow_up_questions": generate_follow_up_questions(session["topic"]),
+            "session_length": updated["session_length"] if updated else 0,
             "timestamp": datetime.utcnow().isoformat()
         }
         
@@ -177,51 +236,36 @@ async def request_concept_explanation(
     """
     try:
         # Verify session
-        if session_id not in active_sessions:
-            db = await get_database()
-            session = await db.tutoring_sessions.find_one({
-                "session_id": session_id,
-                "user_id": current_user.id
-            })
-            if not session:
-                raise HTTPException(status_code=404, detail="Session not found")
-            active_sessions[session_id] = session
-        
-        session = active_sessions[session_id]
+        session = await get_active_session(session_id, current_user.id)
         
         # Build explanation prompt based on type
-        explanation_prompts = {
-            "simple": f"Explain {concept} in {session['subject']} in the simplest terms possible for a {session['difficulty']} level student.",
-            "detailed": f"Provide a comprehensive explanation of {concept} in {session['subject']} with step-by-step breakdown for a {session['difficulty']} level student.",
-            "examples": f"Explain {concept} in {session['subject']} using practical examples and real-world applications for a {session['difficulty']} level student."
-        }
-        
-        prompt = explanation_prompts.get(explanation_type, explanation_prompts["detailed"])
+        prompt = EXPLANATION_PROMPTS.get(explanation_type, EXPLANATION_PROMPTS["detailed"]).format(
+            concept=concept,
+            subject=session["subject"],
+            difficulty=session["difficulty"]
+        )
         
         # Generate explanation using LLaMA
-        explanation = await llama_ai_service.tutor_conversation(
+        explanation = await tutor_conversation(
             user_message=prompt,
-            user_id=current_user.id,
-            session_id=session_id,
-            content_context=session.get("document_context", "")
+            session=session
         )
         
-        # Update session
-        session["conversation_history"].append({
-            "concept_request": concept,
-            "explanation_type": explanation_type,
-            "tutor_explanation": explanation,
-            "timestamp": datetime.utcnow().isoformat()
-        })
-        
-        # Save to database
-        db = await get_database()
-        await db.tutoring_sessions.update_one(
-            {"session_id": session_id},
-            {
-                "$push": {"conversation_history": session["conversation_history"][-1]},
-                "$set": {"last_activity": datetime.utcnow()}
-            }
+        # Save to database while looking up related concepts
+        _, related_concepts = await asyncio.gather(
+            session_writes.write(UpdateOne(
+                {"session_id": session_id},
+                {
+                    "$push": {"conversation_history": {
+                        "concept_request": concept,
+                        "explanation_type": explanation_type,
+                        "tutor_explanation": explanation,
+                        "timestamp": datetime.utcnow().isoformat()
+                    }},
+                    "$set": {"last_activity": datetime.utcnow()}
+                }
+            )),
+            get_related_concepts(concept, session["subject"])
         )
         
         return {
@@ -229,7 +273,7 @@ async def request_concept_explanation(
             "concept": concept,
             "explanation": explanation,
             "explanation_type": explanation_type,
-            "related_concepts": await get_related_concepts(concept, session["subject"]),
+            "related_concepts": related_concepts,
             "timestamp": datetime.utcnow().isoformat()
         }
         
@@ -254,17 +298,7 @@ async def generate_practice_problems(
     """
     try:
         # Verify session
-        if session_id not in active_sessions:
-            db = await get_database()
-            session = await db.tutoring_sessions.find_one({
-                "session_id": session_id,
-                "user_id": current_user.id
-            })
-            if not session:
-                raise HTTPException(status_code=404, detail="Session not found")
-            active_sessions[session_id] = session
-        
-        session = active_sessions[session_id]
+        session = await get_active_session(session_id, current_user.id)
         
         # Generate practice problems using LLaMA
         practice_prompt = f"""
@@ -284,33 +318,27 @@ async def generate_practice_problems(
         Hint: [helpful hint]
         """
         
-        problems_response = await llama_ai_service.tutor_conversation(
+        problems_response = await tutor_conversation(
             user_message=practice_prompt,
-            user_id=current_user.id,
-            session_id=session_id,
-            content_context=session.get("document_context", "")
+            session=session
         )
         
         # Parse the response into structured problems
         problems = parse_practice_problems(problems_response)
         
-        # Update session
-        session["conversation_history"].append({
-            "practice_request": topic,
-            "num_problems": num_problems,
-            "generated_problems": problems,
-            "timestamp": datetime.utcnow().isoformat()
-        })
-        
         # Save to database
-        db = await get_database()
-        await db.tutoring_sessions.update_one(
+        await session_writes.write(UpdateOne(
             {"session_id": session_id},
             {
-                "$push": {"conversation_history": session["conversation_history"][-1]},
+                "$push": {"conversation_history": {
+                    "practice_request": topic,
+                    "num_problems": num_problems,
+                    "generated_problems": problems,
+                    "timestamp": datetime.utcnow().isoformat()
+                }},
                 "$set": {"last_activity": datetime.utcnow()}
             }
-        )
+        ))
         
         return {
             "session_id": session_id,
@@ -341,28 +369,13 @@ async def check_student_answer(
     """
     try:
         # Verify session
-        if session_id not in active_sessions:
-            db = await get_database()
-            session = await db.tutoring_sessions.find_one({
-                "session_id": session_id,
-                "user_id": current_user.id
-            })
-            if not session:
-                raise HTTPException(status_code=404, detail="Session not found")
-            active_sessions[session_id] = session
+        session = await get_active_session(session_id, current_user.id)
         
-        session = active_sessions[session_id]
-        
-        # Find the problem in session history
+        # Find the problem in session history; MongoDB returns just that problem
+        sessions_collection = get_collection("tutoring_sessions")
         problem = None
-        for entry in reversed(session["conversation_history"]):
-            if "generated_problems" in entry:
-                for p in entry["generated_problems"]:
-                    if p.get("id") == problem_id:
-                        problem = p
-                        break
-                if problem:
-                    break
+        async for match in sessions_collection.aggregate(problem_lookup_pipeline(session_id, problem_id)):
+            problem = match.get("problem")
         
         if not problem:
             raise HTTPException(status_code=404, detail="Problem not found in session")
@@ -375,25 +388,21 @@ async def check_student_answer(
             content_context=session.get("document_context", "")
         )
         
-        # Update session with evaluation
-        session["conversation_history"].append({
-            "answer_check": {
-                "problem_id": problem_id,
-                "student_answer": student_answer,
-                "evaluation": evaluation,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-        })
-        
-        # Save to database
-        db = await get_database()
-        await db.tutoring_sessions.update_one(
+        # Save evaluation to session history
+        await session_writes.write(UpdateOne(
             {"session_id": session_id},
             {
-                "$push": {"conversation_history": session["conversation_history"][-1]},
+                "$push": {"conversation_history": {
+                    "answer_check": {
+                        "problem_id": problem_id,
+                        "student_answer": student_answer,
+                        "evaluation": evaluation,
+                        "timestamp": datetime.utcnow().isoformat()
+                    }
+                }},
                 "$set": {"last_activity": datetime.utcnow()}
             }
-        )
+        ))
         
         return {
             "session_id": session_id,
@@ -416,17 +425,28 @@ async def check_student_answer(
 async def get_user_tutoring_sessions(
     current_user: User = Depends(get_current_user),
     limit: int = 10,
-    skip: int = 0
+    after: Optional[datetime] = None
 ):
     """
     Get user's tutoring sessions history
+
+    Pages are keyed by start time: pass the previous page's next_after as
+    after to get the sessions that started before it
     """
     try:
-        db = await get_database()
+        sessions_collection = get_collection("tutoring_sessions")
         
-        sessions = await db.tutoring_sessions.find(
-            {"user_id": current_user.id}
-        ).sort("started_at", -1).skip(skip).limit(limit).to_list(length=limit)
+        query = {"user_id": current_user.id}
+        if after is not None:
+            query["started_at"] = {"$lt": after}
+        
+        # One extra session tells whether another page exists, without counting
+        sessions = await sessions_collection.find(
+            query,
+            SESSION_LIST_PROJECTION
+        ).sort("started_at", -1).limit(limit + 1).to_list(length=limit + 1)
+        has_more = len(sessions) > limit
+        sessions = sessions[:limit]
         
         # Format sessions for response
         formatted_sessions = []
@@ -438,16 +458,14 @@ async def get_user_tutoring_sessions(
                 "difficulty": session["difficulty"],
                 "started_at": session["started_at"],
                 "status": session["status"],
-                "conversation_length": len(session.get("conversation_history", [])),
+                "conversation_length": session["conversation_length"],
                 "learning_goals": session.get("learning_goals", [])
             })
         
-        total = await db.tutoring_sessions.count_documents({"user_id": current_user.id})
-        
         return {
             "sessions": formatted_sessions,
-            "total": total,
-            "skip": skip,
+            "has_more": has_more,
+            "next_after": sessions[-1]["started_at"] if has_more else None,
             "limit": limit
         }
         
@@ -467,9 +485,9 @@ async def get_session_details(
     Get detailed information about a specific tutoring session
     """
     try:
-        db = await get_database()
+        sessions_collection = get_collection("tutoring_sessions")
         
-        session = await db.tutoring_sessions.find_one({
+        session = await sessions_collection.find_one({
             "session_id": session_id,
             "user_id": current_user.id
         })
@@ -508,10 +526,10 @@ async def end_tutoring_session(
     End an active tutoring session
     """
     try:
-        db = await get_database()
+        sessions_collection = get_collection("tutoring_sessions")
         
         # Update session status
-        result = await db.tutoring_sessions.update_one(
+        result = await sessions_collection.update_one(
             {"session_id": session_id, "user_id": current_user.id},
             {
                 "$set": {
@@ -525,8 +543,7 @@ async def end_tutoring_session(
             raise HTTPException(status_code=404, detail="Session not found")
         
         # Remove from active sessions
-        if session_id in active_sessions:
-            del active_sessions[session_id]
+        active_sessions.pop(session_id)
         
         return {
             "message": "Tutoring session ended successfully",
@@ -545,51 +562,152 @@ async def end_tutoring_session(
 
 # Helper functions
 
-async def generate_follow_up_questions(question: str, response: str, topic: str) -> List[str]:
-    """Generate contextual follow-up questions"""
-    follow_ups = [
-        f"Can you explain more about {topic}?",
-        "Can you give me another example?",
-        "How does this apply in real life?",
-        "What should I study next?",
-        "Can you create a practice problem for me?"
+def problem_lookup_pipeline(session_id: str, problem_id: str) -> List[Dict[str, Any]]:
+    """Pipeline selecting a problem from the most recent practice set that contains its id"""
+    latest_set = {"$arrayElemAt": [
+        {"$filter": {
+            "input": "$conversation_history",
+            "as": "entry",
+            "cond": {"$in": [problem_id, {"$ifNull": ["$$entry.generated_problems.id", []]}]}
+        }},
+        -1
+    ]}
+    return [
+        {"$match": {"session_id": session_id, "conversation_history.generated_problems.id": problem_id}},
+        {"$project": {"_id": 0, "problem": {"$arrayElemAt": [
+            {"$filter": {
+                "input": {"$let": {"vars": {"entry": latest_set}, "in": "$$entry.generated_problems"}},
+                "as": "problem",
+                "cond": {"$eq": ["$$problem.id", problem_id]}
+            }},
+            0
+        ]}}}
     ]
-    return follow_ups[:3]
 
-async def get_related_concepts(concept: str, subject: str) -> List[str]:
-    """Get related concepts for a given concept"""
-    # This would ideally use the embedding model from LLaMA service
-    related = ["practice problems", "additional resources", "similar concepts"]
-    return related
+async def get_active_session(session_id: str, user_id: str) -> Dict[str, Any]:
+    """Get a session's settings, loading them once per worker without the conversation history"""
+    session = active_sessions.get(session_id)
+    if session is None:
+        sessions_collection = get_collection("tutoring_sessions")
+        session = await sessions_collection.find_one(
+            {"session_id": session_id, "user_id": user_id},
+            SESSION_PROJECTION
+        )
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        active_sessions.set(session_id, session)
+    elif session["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+async def tutor_reference_context(content_context: str, max_tokens: int) -> str:
+    """Trimmed reference material for a tutor prompt"""
+    if not content_context or max_tokens <= 0:
+        return ""
+    snippet = await asyncio.to_thread(
+        llama_ai_service.truncate_to_tokens, content_context, max_tokens
+    )
+    return f"Reference material: {snippet}"
+
+async def tutor_history(session: Dict[str, Any]) -> str:
+    """The session's most recent question and answer turns, trimmed for a tutor prompt"""
+    sessions_collection = get_collection("tutoring_sessions")
+    doc = await sessions_collection.find_one(
+        {"session_id": session.get("session_id")},
+        {"_id": 0, "session_id": 1, "conversation_history": {"$slice": -TUTOR_HISTORY_TURNS}}
+    )
+    
+    lines = []
+    for entry in (doc or {}).get("conversation_history", []):
+        for question_field, answer_field in HISTORY_TURN_FIELDS:
+            if entry.get(question_field) and entry.get(answer_field):
+                lines.append(f"Student: {entry[question_field]}")
+                lines.append(f"Tutor: {entry[answer_field]}")
+    if not lines:
+        return ""
+    
+    trimmed = await asyncio.to_thread(
+        lambda: [llama_ai_service.truncate_to_tokens(line, TUTOR_HISTORY_TURN_TOKENS) for line in lines]
+    )
+    return "Earlier in this session:\n" + "\n".join(trimmed)
+
+def tutor_cache_scope(session: Dict[str, Any], context: str) -> str:
+    """Cache partition: one subject, level and topic, with the same reference material and recent turns"""
+    parts = (session.get("subject"), session.get("difficulty"), session.get("topic"), context)
+    return hashlib.sha256("|".join(str(part or "") for part in parts).encode()).hexdigest()[:16]
 
-def parse_practice_problems(response: str) -> List[Dict[str, str]]:
-    """Parse practice problems from LLaMA response"""
-    problems = []
-    lines = response.split('\n')
-    current_problem = {}
-    problem_id = 1
+async def build_tutor_prompt(user_message: str, session: Dict[str, Any]) -> Tuple[str, str]:
+    """Fill the tutor prompt for a session, and return it with its cache scope"""
+    if not llama_ai_service.initialized:
+        await llama_ai_service.initialize()
     
-    for line in lines:
-        line = line.strip()
-        if line.startswith('Problem'):
-            if current_problem:
-                current_problem['id'] = str(problem_id - 1)
-                problems.append(current_problem)
-            current_problem = {'statement': line, 'id': str(problem_id)}
-            problem_id += 1
-        elif line.startswith('Context:'):
-            current_problem['context'] = line[8:].strip()
-        elif line.startswith('Approach:'):
-            current_problem['approach'] = line[9:].strip()
-        elif line.startswith('Hint:'):
-            current_problem['hint'] = line[5:].strip()
+    fields = {
+        "topic": session.get("topic", ""),
+        "subject": session.get("subject", ""),
+        "difficulty": session.get("difficulty", ""),
+        "history": await tutor_history(session),
+        "message": user_message
+    }
+    # Reference material gets what the input window leaves after everything else,
+    # so truncation never drops the student's message or the generation header
+    budget = min(
+        TUTOR_CONTEXT_TOKENS,
+        llama_ai_service.prompt_token_budget(TUTOR_PROMPT_TEMPLATE.format(context="", **fields))
+    )
+    context = await tutor_reference_context(session.get("document_context") or "", budget)
     
-    # Add the last problem
-    if current_problem:
-        current_problem['id'] = str(problem_id - 1)
-        problems.append(current_problem)
+    prompt = TUTOR_PROMPT_TEMPLATE.format(context=context, **fields)
+    return prompt, tutor_cache_scope(session, context + fields["history"])
+
+async def tutor_conversation(user_message: str, session: Dict[str, Any]) -> str:
+    """Generate a tutor reply, batched with other students' pending replies"""
+    prompt, scope = await build_tutor_prompt(user_message, session)
+    cached, vector = await tutor_cache.lookup(user_message, scope, llama_ai_service.embedding_model)
+    if cached is not None:
+        return cached
     
-    return problems
+    reply = await generation_batcher.generate(
+        prompt,
+        max_new_tokens=settings.max_tokens,
+        temperature=settings.temperature
+    )
+    tutor_cache.store(user_message, reply, scope, vector)
+    return reply
+
+async def tutor_conversation_stream(user_message: str, session: Dict[str, Any]) -> AsyncGenerator[str, None]:
+    """Yield a tutor reply as the model decodes it"""
+    prompt, scope = await build_tutor_prompt(user_message, session)
+    cached, vector = await tutor_cache.lookup(user_message, scope, llama_ai_service.embedding_model)
+    if cached is not None:
+        yield cached
+        return
+    
+    chunks = []
+    async for chunk in llama_ai_service.generate_response_stream(
+        prompt,
+        max_tokens=settings.max_tokens,
+        temperature=settings.temperature
+    ):
+        chunks.append(chunk)
+        yield chunk
+    tutor_cache.store(user_message, "".join(chunks).strip(), scope, vector)
+
+def generate_follow_up_questions(topic: str) -> List[str]:
+    """Generate contextual follow-up questions"""
+    return [question.format(topic=topic) for question in FOLLOW_UP_QUESTIONS]
+
+async def get_related_concepts(concept: str, subject: str) -> List[str]:
+    """Get related concepts for a given concept from embedding similarity"""
+    key = (subject.lower(), normalize_prompt(concept))
+    related = related_concepts_cache.get(key)
+    if related is None:
+        if not llama_ai_service.initialized:
+            await llama_ai_service.initialize()
+        related = await llama_ai_service.find_related_concepts(concept, subject)
+        # The generic fallback means the embedder was missing or failed; retry next time
+        if related is not DEFAULT_RELATED_CONCEPTS:
+            related_concepts_cache.set(key, related)
+    return related
 
 def generate_next_steps(evaluation: Dict[str, Any]) -> List[str]:
     """Generate next steps based on answer evaluation"""
@@ -622,27 +740,37 @@ async def tutoring_websocket(websocket: WebSocket, session_id: str):
     """
     await websocket.accept()
     
+    # The session's subject, level and topic shape the replies and their cache partition
+    session = active_sessions.get(session_id)
+    if session is None:
+        session = await get_collection("tutoring_sessions").find_one({"session_id": session_id}, SESSION_PROJECTION)
+        if not session:
+            await websocket.close(code=1008)
+            return
+        active_sessions.set(session_id, session)
+    
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message_data = orjson.loads(data)
             
-            # Process the tutoring request
+            # Process the tutoring request, sending text as it is generated
             if message_data.get("type") == "question":
-                response = await llama_ai_service.tutor_conversation(
-                    user_message=message_data["message"],
-                    user_id=message_data["user_id"],
-                    session_id=session_id,
-                    content_context=""
-                )
+                chunks = []
+                async for chunk in tutor_conversation_stream(message_data["message"], session):
+                    chunks.append(chunk)
+                    await websocket.send_text(dumps({
+                        "type": "token",
+                        "message": chunk
+                    }).decode())
                 
-                # Send response back
-                await websocket.send_text(json.dumps({
-                    "type": "response",
-                    "message": response,
-                    "timestamp": datetime.utcnow().isoformat()
-                }))
+                # Close the reply with the full text
+                await websocket.send_text(dumps({
+                    "type": "done",
+                    "message": "".join(chunks).strip(),
+                    "timestamp": datetime.utcnow()
+                }).decode())
                 
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected for session {session_id}")
@@ -12,19 +12,50 @@ class Settings(BaseSettings):
     # Database
     mongodb_url: str = "mongodb://localhost:27017"
     database_name: str = "study_assistant_db"
+    mongodb_max_pool_size: int = 50
+    mongodb_min_pool_size: int = 10
+    mongodb_max_idle_time_ms: int = 60000
+    mongodb_compressors: str = "zstd,zlib"  # wire compression, first one the server supports; zstd needs the zstandard package
+    mongodb_zlib_compression_level: int = 6
     
     # AI Model Configuration
     llama_model_name: str = "meta-llama/Llama-3.2-3B-Instruct"
     embedding_model: str = "all-MiniLM-L6-v2"
     max_tokens: int = 400
+    llm_context_window: int = 8192  # tokens available for prompt + response
     temperature: float = 0.7
     device: str = "cuda"  # or "cpu"
+    model_quantization: str = "none"  # opt-in: "int8" or "int4"; "awq"/"gptq" checkpoints on vLLM
+    llm_kv_cache_dtype: str = "auto"  # vLLM only; "fp8" halves KV cache memory
+    llm_draft_model_name: str = "meta-llama/Llama-3.2-1B-Instruct"  # vLLM speculative decoding; "" disables
+    llm_num_speculative_tokens: int = 5
+    llm_backend: str = "transformers"  # or "vllm" for continuous batching on GPU
+    llm_preload: bool = False  # load and warm LLaMA at startup; enable when the LLaMA-backed routers are mounted
+    torch_compile: bool = True  # compile the transformers forward pass; no effect with model_quantization int8/int4
     model_cache_dir: str = "./data/models"
+    llm_batch_max_size: int = 8  # prompts coalesced into one forward pass
+    llm_batch_window_ms: int = 10  # how long to wait for more prompts to join a batch
+    llm_batch_long_request_tokens: int = 1000  # larger output budgets are batched separately
     
     # Gemini AI Configuration
     gemini_api_key: str = ""
     gemini_model: str = "gemini-2.5-flash"
     
+    # Caching
+    dashboard_cache_ttl: int = 300  # seconds
+    dashboard_cache_size: int = 1024
+    document_content_cache_ttl: int = 300  # seconds
+    document_content_cache_size: int = 128  # entries hold full document text
+    tutor_cache_ttl: int = 86400  # seconds
+    tutor_cache_size: int = 2048
+    tutor_cache_similarity: float = 0.97  # cosine similarity for reusing a near-identical prompt's reply
+    tutor_cache_max_scopes: int = 256  # subject/level/topic partitions holding prompt embeddings
+    active_session_cache_ttl: int = 3600  # seconds
+    active_session_cache_size: int = 1000
+    related_concepts_cache_ttl: int = 86400  # seconds
+    related_concepts_cache_size: int = 1024
+    quiz_template_ttl: int = 604800  # seconds a generated quiz is reused for identical requests
+    
     # Security
     secret_key: str = "your-super-secret-key-change-in-production"
     algorithm: str = "HS256"
@@ -1,13 +1,26 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from bson import ObjectId
 from pymongo import IndexModel, ASCENDING, TEXT
+from pymongo.errors import BulkWriteError, OperationFailure
+from functools import lru_cache
+from typing import List, Optional
+import asyncio
 import logging
+import re
 from .config import get_settings
 
 settings = get_settings()
 
+# Compound index backing per-user document lookups sorted by upload time
+USER_DOCUMENTS_INDEX = [("user_id", ASCENDING), ("upload_date", -1)]
+
+# Ids that are valid ObjectIds; uploads use UUID strings instead
+OBJECT_ID_PATTERN = re.compile(r"^[0-9a-fA-F]{24}$")
+
 class Database:
     client: AsyncIOMotorClient = None
     database = None
+    content_bucket: AsyncIOMotorGridFSBucket = None
 
 db = Database()
 
@@ -16,13 +29,23 @@ async def connect_to_mongo():
     try:
         db.client = AsyncIOMotorClient(
             settings.mongodb_url,
-            serverSelectionTimeoutMS=5000  # Fail fast
+            serverSelectionTimeoutMS=5000,  # Fail fast
+            maxPoolSize=settings.mongodb_max_pool_size,
+            minPoolSize=settings.mongodb_min_pool_size,
+            maxIdleTimeMS=settings.mongodb_max_idle_time_ms,
+            compressors=settings.mongodb_compressors,
+            zlibCompressionLevel=settings.mongodb_zlib_compression_level,
+            retryWrites=True
         )
         db.database = db.client[settings.database_name]
         
-        # Test the connection
+        # Test the connection; this also selects the primary so the first
+        # request checks out a pooled connection instead of waiting on discovery
         await db.client.admin.command('ping')
         
+        # Resolve the hot collection handle up front
+        get_collection("documents")
+        
         # Create indexes
         await create_indexes()
         
@@ -37,41 +60,83 @@ async def close_mongo_connection():
     try:
         if db.client:
             db.client.close()
+            get_collection.cache_clear()
             logging.info("📝 Disconnected from MongoDB")
     except Exception:
         pass  # Silent close
 
+async def create_optional_index(collection, keys, **kwargs):
+    """
+    Create a performance-only index; a conflict with an existing index or a
+    failed build is logged instead of aborting startup
+    """
+    try:
+        await collection.create_index(keys, **kwargs)
+    except OperationFailure as e:
+        logging.warning(f"⚠️ Skipped index {keys} on {collection.name}: {str(e)}")
+
 async def create_indexes():
     """Create database indexes for better performance"""
     try:
         # Users collection indexes
         users_collection = db.database.users
         await users_collection.create_index("email", unique=True)
-        await users_collection.create_index("created_at")
+        await create_optional_index(users_collection, "created_at")
         
         # Documents collection indexes
         documents_collection = db.database.documents
-        await documents_collection.create_index("upload_date")
-        await documents_collection.create_index("processing_status")
-        await documents_collection.create_index("filename")
+        await create_optional_index(documents_collection, USER_DOCUMENTS_INDEX)
+        await create_optional_index(documents_collection, "upload_date")
+        await create_optional_index(documents_collection, "processing_status")
+        await create_optional_index(documents_collection, "filename")
         
         # Study sessions indexes
         sessions_collection = db.database.study_sessions
-        await sessions_collection.create_index([("user_id", ASCENDING), ("created_at", -1)])
-        await sessions_collection.create_index("is_active")
+        await create_optional_index(sessions_collection, [("user_id", ASCENDING), ("created_at", -1)])
+        await create_optional_index(sessions_collection, "is_active")
         
         # Chat history indexes
         chat_collection = db.database.chat_history
-        await chat_collection.create_index([("user_id", ASCENDING), ("timestamp", -1)])
+        await create_optional_index(chat_collection, [("user_id", ASCENDING), ("timestamp", -1)])
         
         # Content collection with text search
         content_collection = db.database.content
-        await content_collection.create_index([("title", TEXT), ("content", TEXT)])
-        await content_collection.create_index("subject")
+        await create_optional_index(content_collection, [("title", TEXT), ("content", TEXT)])
+        await create_optional_index(content_collection, "subject")
+        
+        # Tutoring sessions: lookups by session id (alone or with the owner),
+        # and per-user listing paged by start time
+        tutoring_sessions_collection = db.database.tutoring_sessions
+        await tutoring_sessions_collection.create_index(
+            [("session_id", ASCENDING), ("user_id", ASCENDING)],
+            unique=True
+        )
+        await create_optional_index(tutoring_sessions_collection, [("user_id", ASCENDING), ("started_at", -1)])
+        
+        # Quiz indexes: ownership lookups, per-user history and attempts
+        quizzes_collection = db.database.quizzes
+        await quizzes_collection.create_index([("quiz_id", ASCENDING), ("user_id", ASCENDING)], unique=True)
+        await create_optional_index(quizzes_collection, [("user_id", ASCENDING), ("created_at", -1)])
+        
+        quiz_attempts_collection = db.database.quiz_attempts
+        await create_optional_index(
+            quiz_attempts_collection,
+            [("quiz_id", ASCENDING), ("user_id", ASCENDING), ("submitted_at", -1)]
+        )
+        
+        # Generated quiz templates, keyed by request and content hash and
+        # expired by MongoDB so identical requests eventually get a fresh quiz
+        quiz_templates_collection = db.database.quiz_templates
+        await quiz_templates_collection.create_index("cache_key", unique=True)
+        await create_optional_index(
+            quiz_templates_collection,
+            "created_at",
+            expireAfterSeconds=settings.quiz_template_ttl
+        )
         
         # Progress tracking indexes
         progress_collection = db.database.progress
-        await progress_collection.create_index([("user_id", ASCENDING), ("subject", ASCENDING)])
+        await create_optional_index(progress_collection, [("user_id", ASCENDING), ("subject", ASCENDING)])
         
         logging.info("✅ Database indexes created successfully")
         
@@ -82,4 +147,110 @@ async def create_indexes():
 async def get_database():
     """Get database instance"""
     return db.database
-    
\ No newline at end of file
+
+@lru_cache(maxsize=None)
+def get_collection(name: str):
+    """Get a collection handle, resolved once per process after connecting"""
+    if db.database is None:
+        raise RuntimeError("Database is not connected")
+    return db.database[name]
+
+async def get_content_bucket() -> AsyncIOMotorGridFSBucket:
+    """Get the GridFS bucket holding extracted document text"""
+    if db.content_bucket is None:
+        db.content_bucket = AsyncIOMotorGridFSBucket(db.database, bucket_name="document_content")
+    return db.content_bucket
+
+async def store_document_content(filename: str, content: str):
+    """Store extracted document text in GridFS and return its file id"""
+    bucket = await get_content_bucket()
+    return await bucket.upload_from_stream(filename, content.encode("utf-8"))
+
+def to_mongo_id(document_id: str):
+    """Use an ObjectId for 24-hex ids and the raw string (upload UUIDs) otherwise"""
+    return ObjectId(document_id) if OBJECT_ID_PATTERN.match(document_id) else document_id
+
+async def load_document_content(document: dict) -> str:
+    """Read a document's text from GridFS, falling back to inline content on older documents"""
+    if document.get("content_id"):
+        bucket = await get_content_bucket()
+        stream = await bucket.open_download_stream(document["content_id"])
+        return (await stream.read()).decode("utf-8")
+    return document.get("content", "")
+
+async def delete_document_content(document: dict):
+    """Remove a document's GridFS text, if it has any"""
+    if document.get("content_id"):
+        bucket = await get_content_bucket()
+        await bucket.delete(document["content_id"])
+    
+
+class BulkWriteBatcher:
+    """
+    Coalesces concurrent single-document writes to one collection into
+    unordered bulk_write calls. Writes queued while a bulk_write is in flight
+    go out together in the next one, so a lone write is never delayed
+    """
+    
+    def __init__(self, collection_name: str, max_ops: int = 100):
+        self.collection_name = collection_name
+        self.max_ops = max_ops
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def write(self, operation):
+        """Queue a pymongo write operation (e.g. UpdateOne) and wait until it is applied"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((operation, future))
+        await future
+    
+    async def stop(self):
+        """Stop the worker and fail any writes still waiting"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Bulk write batcher stopped"))
+        self._worker = None
+        self._queue = None
+    
+    async def _collect(self) -> List[tuple]:
+        """Wait for one write, then take whatever else is already queued"""
+        batch = [await self._queue.get()]
+        while len(batch) < self.max_ops and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+    
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            failed = {}
+            try:
+                await get_collection(self.collection_name).bulk_write(
+                    [operation for operation, _ in batch],
+                    ordered=False  # Writes from different requests commute
+                )
+            except BulkWriteError as e:
+                if e.details.get("writeConcernErrors"):
+                    failed = {index: e for index in range(len(batch))}
+                else:
+                    failed = {error["index"]: e for error in e.details.get("writeErrors", [])}
+            except Exception as e:
+                failed = {index: e for index in range(len(batch))}
+            
+            for index, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if index in failed:
+                    future.set_exception(failed[index])
+                else:
+                    future.set_result(None)
@@ -0,0 +1,23 @@
+from typing import Any
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+import orjson
+
+# Options matching what stdlib json accepted: numpy values and non-string keys
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def orjson_default(value: Any) -> Any:
+    """Serialize BSON types orjson does not handle natively"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(content: Any) -> bytes:
+    """Encode MongoDB documents to JSON in a single orjson call"""
+    return orjson.dumps(content, default=orjson_default, option=ORJSON_OPTIONS)
+
+class MongoJSONResponse(JSONResponse):
+    """JSON response rendered by orjson, with ObjectId and datetime support"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -7,7 +7,7 @@ import uvicorn
 import logging
 from datetime import datetime, timedelta
 import uuid
-from bson import ObjectId
+from core.responses import MongoJSONResponse
 
 # Request/Response Models
 class QuizGenerationRequest(BaseModel):
@@ -17,21 +17,6 @@ class QuizGenerationRequest(BaseModel):
 class FlashcardGenerationRequest(BaseModel):
     num_cards: int = Field(default=15, description="Number of flashcards to generate")
 
-# Comprehensive recursive serialization function for MongoDB documents
-def serialize_value(value):
-    """Recursively serialize any value, converting ObjectId and datetime to strings"""
-    if value is None:
-        return None
-    if isinstance(value, ObjectId):
-        return str(value)
-    if isinstance(value, datetime):
-        return value.isoformat()
-    if isinstance(value, dict):
-        return {k: serialize_value(v) for k, v in value.items()}
-    if isinstance(value, list):
-        return [serialize_value(item) for item in value]
-    return value
-
 # Simple imports without complex dependencies
 try:
     from core.config import get_settings
@@ -156,6 +141,16 @@ except Exception as e:
     gemini_ai_service = None
     ai_service = None
 
+# Import LLaMA service (local model; optional). Only with llm_preload, so the
+# Gemini-only app does not pull in torch and transformers at startup
+llama_ai_service = None
+generation_batcher = None
+if getattr(settings, 'llm_preload', False):
+    try:
+        from services.llama_service import llama_ai_service, generation_batcher
+    except Exception as e:
+        logger.warning(f"Failed to import LLaMA service: {e}")
+
 # Import document processor
 try:
     from services.document_processor import DocumentProcessor
@@ -191,6 +186,19 @@ async def lifespan(app: FastAPI):
     else:
         logger.warning("⚠️ Gemini service not available")
     
+    # Load LLaMA before accepting requests so the first call does not pay for it
+    if llama_ai_service:
+        try:
+            await llama_ai_service.load()
+            logger.info("✅ LLaMA model loaded and warmed up!")
+        except Exception as e:
+            logger.error(f"❌ LLaMA preload failed: {str(e)}")
+            logger.warning("⚠️ Model will be loaded on first request")
+    
+    # Coalesce concurrent LLaMA requests into batched forward passes
+    if generation_batcher:
+        await generation_batcher.start()
+    
     logger.info("🎓 AI Study Assistant ready!")
     
     yield
@@ -198,6 +206,12 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("📚 Shutting down AI Study Assistant...")
     
+    if generation_batcher:
+        await generation_batcher.stop()
+    
+    if llama_ai_service:
+        await llama_ai_service.unload()
+    
     # Close MongoDB connection
     if mongodb_available and close_mongo_connection:
         try:
@@ -243,7 +257,8 @@ app = FastAPI(
     version="2.0.0",
     lifespan=lifespan,
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=MongoJSONResponse
 )
 
 # CORS middleware
@@ -870,6 +885,9 @@ async def generate_flashcards_for_document(doc_id: str, flashcard_request: Flash
                 
                 # Transform to flashcard format with spaced repetition metadata
                 flashcards = []
+                now = datetime.now()
+                created_at = now.isoformat()
+                next_review = (now + timedelta(days=1)).isoformat()
                 for card_data in flashcards_raw:
                     card_id = str(uuid.uuid4())
                     flashcard = {
@@ -879,10 +897,10 @@ async def generate_flashcards_for_document(doc_id: str, flashcard_request: Flash
                         "back": card_data.get('answer', ''),
                         "difficulty": 3,  # Default medium difficulty
                         "topic": doc['filename'],
-                        "next_review": (datetime.now() + timedelta(days=1)).isoformat(),
+                        "next_review": next_review,
                         "review_count": 0,
                         "confidence_level": 0,
-                        "created_at": datetime.now().isoformat()
+                        "created_at": created_at
                     }
                     flashcards.append(flashcard)
                     # Add to global flashcards store (in-memory fallback)
@@ -904,18 +922,19 @@ async def generate_flashcards_for_document(doc_id: str, flashcard_request: Flash
                 
                 logger.info(f"✅ Generated {len(flashcards)} flashcards for {doc['filename']}")
                 
-                # Serialize before returning
-                return {
+                # orjson encodes ObjectId and datetime values without copying the cards
+                return MongoJSONResponse({
                     "success": True,
                     "message": "Flashcards generated successfully",
                     "document_id": doc_id,
-                    "flashcards": serialize_value(flashcards),
+                    "flashcards": flashcards,
                     "total": len(flashcards)
-                }
+                })
             except Exception as e:
                 logger.error(f"Gemini flashcard generation failed: {e}")
                 # Fallback to simple generation
                 flashcards = []
+                created_at = datetime.utcnow().isoformat()
                 sentences = content.split('. ')[:20]
                 for i, sentence in enumerate(sentences):
                     if len(sentence.strip()) > 20:
@@ -924,7 +943,7 @@ async def generate_flashcards_for_document(doc_id: str, flashcard_request: Flash
                             'question': f"What is covered in: {sentence[:50]}...?",
                             'answer': sentence.strip(),
                             'difficulty': 'medium',
-                            'created_at': datetime.utcnow().isoformat()
+                            'created_at': created_at
                         })
                 
                 doc['flashcards'] = flashcards
@@ -2360,6 +2379,9 @@ async def generate_flashcards(request: FlashcardGenerateRequest):
             
             # Add spaced repetition metadata
             flashcards = []
+            now = datetime.now()
+            created_at = now.isoformat()
+            next_review = (now + timedelta(days=1)).isoformat()
             for card_data in flashcards_raw:
                 card_id = str(uuid.uuid4())
                 flashcard = {
@@ -2369,10 +2391,10 @@ async def generate_flashcards(request: FlashcardGenerateRequest):
                     "back": card_data.get('answer', card_data.get('back', '')),
                     "difficulty": card_data.get('difficulty', 3),
                     "topic": card_data.get('topic', doc.get('filename', 'General')),
-                    "next_review": (datetime.now() + timedelta(days=1)).isoformat(),
+                    "next_review": next_review,
                     "review_count": 0,
                     "confidence_level": 0,
-                    "created_at": datetime.now().isoformat()
+                    "created_at": created_at
                 }
                 flashcards.append(flashcard)
                 flashcards_store[card_id] = flashcard
@@ -2387,13 +2409,13 @@ async def generate_flashcards(request: FlashcardGenerateRequest):
                 except Exception as e:
                     logger.warning(f"Failed to save flashcards to MongoDB: {e}")
             
-            # Serialize before returning
-            return {
+            # orjson encodes ObjectId and datetime values without copying the cards
+            return MongoJSONResponse({
                 "success": True,
-                "flashcards": serialize_value(flashcards),
+                "flashcards": flashcards,
                 "total": len(flashcards),
                 "document_id": document_id
-            }
+            })
         else:
             raise HTTPException(status_code=503, detail="AI service not available")
             
@@ -2425,12 +2447,12 @@ async def get_due_flashcards():
             # Sort by difficulty (harder cards first) and review count (less reviewed first)
             due_cards.sort(key=lambda c: (-c['difficulty'], c['review_count']))
             
-            # Serialize before returning
-            return {
-                "flashcards": serialize_value(due_cards),
+            # orjson encodes ObjectId and datetime values without copying the cards
+            return MongoJSONResponse({
+                "flashcards": due_cards,
                 "total_due": len(due_cards),
                 "total_cards": len(all_cards)
-            }
+            })
         except Exception as e:
             logger.warning(f"Failed to read flashcards from MongoDB: {e}")
     
@@ -2443,12 +2465,12 @@ async def get_due_flashcards():
     # Sort by difficulty (harder cards first) and review count (less reviewed first)
     due_cards.sort(key=lambda c: (-c['difficulty'], c['review_count']))
     
-    # Serialize before returning
-    return {
-        "flashcards": serialize_value(due_cards),
+    # orjson encodes ObjectId and datetime values without copying the cards
+    return MongoJSONResponse({
+        "flashcards": due_cards,
         "total_due": len(due_cards),
         "total_cards": len(flashcards_store)
-    }
+    })
 
 @app.post("/api/flashcards/{card_id}/review", tags=["Flashcards"])
 async def review_flashcard(card_id: str, confidence: int):
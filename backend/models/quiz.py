@@ -0,0 +1,33 @@
+# Quiz-related Pydantic models
+
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional
+
+class QuizQuestion(BaseModel):
+    """One generated quiz question"""
+    # Unguided models write numeric answers and options as numbers
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+    
+    id: str = Field(..., description="Question identifier, e.g. q1")
+    type: str = Field(..., description="multiple_choice, true_false or short_answer")
+    question: str = Field(..., description="Question text")
+    options: List[str] = Field(default_factory=list, description="Lettered options for multiple choice")
+    correct_answer: str = Field(..., description="Correct option letter or answer text")
+    explanation: str = Field("", description="Why the answer is correct")
+    difficulty: str = Field("medium", description="easy, medium or hard")
+    points: int = Field(10, description="Points awarded for a correct answer")
+    concept: str = Field("", description="Key concept being tested")
+
+class QuizOutput(BaseModel):
+    """Quiz as generated by the model, also used as its guided decoding schema"""
+    title: str = Field(..., description="Quiz title")
+    description: str = Field("", description="Brief description")
+    questions: List[QuizQuestion] = Field(..., description="Generated questions")
+
+class QuizRequest(BaseModel):
+    topic: str
+    subject: str
+    difficulty: str = "medium"
+    num_questions: int = 10
+    question_types: List[str] = ["multiple_choice", "true_false", "short_answer"]
+    document_id: Optional[str] = None
@@ -31,6 +31,7 @@ except ImportError:
     tiktoken = None
 
 from services.gemini_service import get_gemini_service
+from services.response_parsers import FLASHCARD_PATTERN
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -646,48 +647,29 @@ class DocumentProcessor:
     def _convert_flashcards_format(self, flashcards_list: List[Dict[str, str]]) -> List[Dict[str, str]]:
         """Convert Gemini flashcards format to expected format"""
         converted = []
+        created_at = datetime.now().isoformat()
         for card in flashcards_list:
             converted.append({
                 'front': card.get('question', ''),
                 'back': card.get('answer', ''),
                 'difficulty': 'medium',
                 'tags': [],
-                'created_at': datetime.now().isoformat()
+                'created_at': created_at
             })
         return converted
     
     def _parse_flashcards(self, flashcards_text: str) -> List[Dict[str, str]]:
         """Parse flashcards from LLaMA response (legacy method)"""
-        flashcards = []
-        lines = flashcards_text.split('\n')
-        current_question = ""
-        current_answer = ""
-        
-        for line in lines:
-            line = line.strip()
-            if line.startswith('Q:'):
-                if current_question and current_answer:
-                    flashcards.append({
-                        'front': current_question,
-                        'back': current_answer,
-                        'difficulty': 'medium',
-                        'created_at': datetime.utcnow().isoformat()
-                    })
-                current_question = line[2:].strip()
-                current_answer = ""
-            elif line.startswith('A:'):
-                current_answer = line[2:].strip()
-        
-        # Add the last flashcard
-        if current_question and current_answer:
-            flashcards.append({
-                'front': current_question,
-                'back': current_answer,
+        created_at = datetime.utcnow().isoformat()
+        return [
+            {
+                'front': question,
+                'back': answer,
                 'difficulty': 'medium',
-                'created_at': datetime.utcnow().isoformat()
-            })
-        
-        return flashcards
+                'created_at': created_at
+            }
+            for question, answer in FLASHCARD_PATTERN.findall(flashcards_text)
+        ]
     
     async def _save_to_database(self, user_id: str, filename: str, file_path: Path, 
                                content: Dict[str, Any], analysis: Dict[str, Any], 
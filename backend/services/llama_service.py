@@ -2,25 +2,77 @@
 # Advanced AI service for content analysis, quiz generation, and tutoring
 
 import asyncio
-import json
+import bisect
+import importlib.util
 import logging
-from typing import Dict, List, Any, Optional, AsyncGenerator
+import queue
+from typing import Dict, List, Any, Optional, AsyncGenerator, Tuple
+from collections import defaultdict
 from datetime import datetime
-import httpx
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer, pipeline
+)
 from sentence_transformers import SentenceTransformer
 import threading
 from pydantic import BaseModel
 import os
+import uuid
 from core.config import get_settings
 
+# bitsandbytes is only needed once a quantized model loads; check for it without importing it
+if importlib.util.find_spec("bitsandbytes") is not None:
+    from transformers import BitsAndBytesConfig
+else:
+    BitsAndBytesConfig = None
+
+try:
+    from vllm import AsyncEngineArgs, AsyncLLMEngine, SamplingParams
+    from vllm.sampling_params import GuidedDecodingParams
+except ImportError:
+    AsyncLLMEngine = None
+    GuidedDecodingParams = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
+# Rough characters-per-token ratio used when no tokenizer is loaded
+CHARS_PER_TOKEN_ESTIMATE = 4
+
+# Tokens a chat template adds around a user prompt (BOS, role headers, date line)
+CHAT_TEMPLATE_TOKENS = 64
+
+# Longest wait for the next streamed chunk, prompt prefill included, before giving up
+STREAM_CHUNK_TIMEOUT = 120  # seconds
+
+class StopOnEvent(StoppingCriteria):
+    """Stops generate() once the event is set, e.g. when a streaming client goes away"""
+    
+    def __init__(self, event: threading.Event):
+        self.event = event
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+# Prompt length bucket bounds in tokens; only similar-length prompts share a padded batch
+PROMPT_LENGTH_BUCKETS = (128, 512, 2048)
+
+# Concepts per subject for related-concept lookups; subjects not listed use mathematics
+SUBJECT_CONCEPTS = {
+    "mathematics": ["algebra", "calculus", "geometry", "statistics", "trigonometry", "derivatives", "integrals", "equations", "functions", "probability"],
+    "physics": ["mechanics", "thermodynamics", "electromagnetism", "quantum", "relativity", "waves", "energy", "momentum", "force", "acceleration"],
+    "chemistry": ["atoms", "molecules", "reactions", "bonds", "periodic table", "acids", "bases", "organic", "inorganic", "kinetics"],
+    "computer science": ["algorithms", "data structures", "programming", "databases", "networks", "security", "machine learning", "AI", "software engineering"],
+    "biology": ["cells", "genetics", "evolution", "ecology", "anatomy", "physiology", "DNA", "proteins", "organisms", "ecosystems"]
+}
+DEFAULT_RELATED_CONCEPTS = ["Practice Problems", "Study Methods", "Additional Resources"]
+
+# Study reply used when the model returns an empty or near-empty answer
+SHORT_RESPONSE_FALLBACK = "I understand you're asking about '{question}'. Let me help you with that topic."
+
 class ConversationContext(BaseModel):
     """Context for maintaining conversation state"""
     user_id: str
@@ -54,6 +106,8 @@ class LlamaAIService:
             self.model = None
             self.pipe = None
             self.embedding_model = None
+            self.concept_embeddings: Dict[str, Any] = {}  # subject -> normalized concept embeddings
+            self.vllm_engine = None
             self.max_context_length = 1024  # Smaller for faster processing
             self.conversation_contexts: Dict[str, ConversationContext] = {}
             self.initialized = False
@@ -69,6 +123,17 @@ class LlamaAIService:
             
         logger.info("🚀 Initializing AI Study Assistant model...")
         
+        if getattr(settings, 'llm_backend', 'transformers') == "vllm":
+            if AsyncLLMEngine is None:
+                logger.warning("⚠️ vLLM backend requested but vllm is not installed; using transformers")
+            else:
+                try:
+                    self._init_vllm()
+                    self._load_embedding_model()
+                    return
+                except Exception as e:
+                    logger.warning(f"❌ Failed to start vLLM engine: {str(e)}")
+        
         # Try models in order of preference: LLaMA 3.2 Instruct -> GPT-2 -> DialoGPT  
         models_to_try = [
             {
@@ -113,23 +178,15 @@ class LlamaAIService:
             try:
                 logger.info(f"📥 Attempting to load: {model_config['description']}")
                 
-                from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-                
                 # Load tokenizer and model
                 self.tokenizer = AutoTokenizer.from_pretrained(
                     model_config["name"],
                     padding_side='left',
+                    truncation_side='left',  # an overlong prompt keeps its end and the generation header
                     trust_remote_code=True
                 )
                 
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    model_config["name"],
-                    torch_dtype=torch.float32,  # Use float32 for CPU compatibility
-                    device_map=None,  # CPU only for stability
-                    trust_remote_code=True,
-                    use_cache=True,     # Enable KV cache for faster inference
-                    low_cpu_mem_usage=True  # Optimize memory usage
-                )
+                self.model = self._load_model(model_config["name"])
                 
                 # Set special tokens
                 if self.tokenizer.pad_token is None:
@@ -142,13 +199,15 @@ class LlamaAIService:
                     logger.info(f"Using direct model access for {model_config['description']}")
                 else:
                     # Create pipeline for text generation (older models)
+                    # Models placed by accelerate (bitsandbytes) already have a device
+                    device_kwargs = {} if hasattr(self.model, "hf_device_map") else {"device": -1}  # CPU
                     self.pipe = pipeline(
                         "text-generation",
                         model=self.model,
                         tokenizer=self.tokenizer,
-                        device=-1,  # CPU
                         do_sample=True,
-                        temperature=0.8
+                        temperature=0.8,
+                        **device_kwargs
                     )
                 
                 self.model_name = model_config["name"]
@@ -164,9 +223,11 @@ class LlamaAIService:
         if not self.initialized:
             raise Exception("❌ Failed to load any AI model. Cannot proceed without real AI.")
         
-        # Load embedding model for similarity (optional)
+        self._load_embedding_model()
+    
+    def _load_embedding_model(self):
+        """Load the sentence embedding model used for similarity (optional on every backend)"""
         try:
-            from sentence_transformers import SentenceTransformer
             embedding_model_name = getattr(settings, 'embedding_model', 'all-MiniLM-L6-v2')
             self.embedding_model = SentenceTransformer(embedding_model_name)
             logger.info("✅ Embedding model loaded successfully!")
@@ -174,6 +235,173 @@ class LlamaAIService:
             logger.warning(f"⚠️ Embedding model not available: {e}")
             self.embedding_model = None
     
+    async def load(self):
+        """Load the model and run a short warmup generation so the first request is not a cold start"""
+        await self.initialize()
+        
+        # Compiles kernels and allocates the KV cache ahead of real traffic
+        await self.agenerate("warmup", max_tokens=8, temperature=0.0)
+        logger.info("🔥 Model warmed up")
+    
+    async def unload(self):
+        """Release the model weights and any GPU memory they hold"""
+        self.model = None
+        self.pipe = None
+        self.vllm_engine = None
+        self.embedding_model = None
+        self.concept_embeddings = {}
+        self.initialized = False
+        
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    
+    def _init_vllm(self):
+        """Start a vLLM engine whose scheduler continuously batches concurrent requests"""
+        self.vllm_engine = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(
+            model=self.model_name,
+            dtype="float16",
+            max_model_len=settings.llm_context_window,
+            max_num_batched_tokens=max(4096, settings.llm_context_window),
+            kv_cache_dtype=settings.llm_kv_cache_dtype,
+            speculative_config=self._vllm_speculative_config(),
+            **self._vllm_quantization_args()
+        ))
+        # Kept for chat templates and token counting
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, padding_side='left')
+        self.initialized = True
+        logger.info(f"✅ vLLM engine ready: {self.model_name}")
+    
+    def _vllm_quantization_args(self) -> Dict[str, Any]:
+        """Map settings.model_quantization onto vLLM engine arguments"""
+        quantization = getattr(settings, 'model_quantization', 'none').lower()
+        if quantization == "int4":
+            # 4-bit weights quantized while loading, no pre-quantized checkpoint needed
+            return {"quantization": "bitsandbytes", "load_format": "bitsandbytes"}
+        if quantization == "int8":
+            # 8-bit FP weights quantized while loading
+            return {"quantization": "fp8"}
+        if quantization in ("awq", "gptq"):
+            # llama_model_name must point at a checkpoint quantized with this method
+            return {"quantization": quantization}
+        return {}
+    
+    def _vllm_speculative_config(self) -> Optional[Dict[str, Any]]:
+        """Draft model settings; it must share the main model's tokenizer"""
+        if not settings.llm_draft_model_name:
+            return None
+        # Templated output such as quiz JSON lets the target accept long runs of draft tokens
+        return {
+            "model": settings.llm_draft_model_name,
+            "num_speculative_tokens": settings.llm_num_speculative_tokens
+        }
+    
+    def _chat_text(self, messages: List[Dict[str, str]]) -> str:
+        """Render chat messages with the model's template, if it has one"""
+        if getattr(self.tokenizer, "chat_template", None):
+            return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return "\n\n".join(message["content"] for message in messages)
+    
+    async def _vllm_stream(
+        self,
+        text: str,
+        max_tokens: int,
+        temperature: float,
+        json_schema: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """Yield the cumulative output of one vLLM request as it decodes"""
+        # A JSON schema constrains decoding so the output always parses
+        guided_decoding = GuidedDecodingParams(json=json_schema) if json_schema else None
+        sampling_params = SamplingParams(
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=0.9,
+            guided_decoding=guided_decoding
+        )
+        async for output in self.vllm_engine.generate(text, sampling_params, request_id=uuid.uuid4().hex):
+            yield output.outputs[0].text
+    
+    async def agenerate(
+        self,
+        prompt: str,
+        max_tokens: int = 256,
+        temperature: float = 0.6,
+        json_schema: Optional[str] = None
+    ) -> str:
+        """Generate a response for one prompt; concurrent calls share batches on vLLM"""
+        if not self.initialized:
+            await self.initialize()
+        
+        if self.vllm_engine is None:
+            return (await self.generate_batch([prompt], max_tokens, temperature))[0]
+        
+        text = ""
+        chat_text = self._chat_text([{"role": "user", "content": prompt}])
+        async for text in self._vllm_stream(chat_text, max_tokens, temperature, json_schema):
+            pass
+        return text.strip()
+    
+    def _load_model(self, model_name: str):
+        """Load a causal LM, quantized according to settings.model_quantization"""
+        quantization = getattr(settings, 'model_quantization', 'none').lower()
+        load_kwargs = {
+            "trust_remote_code": True,
+            "use_cache": True,     # Enable KV cache for faster inference
+            "low_cpu_mem_usage": True  # Optimize memory usage
+        }
+        
+        # GPU: load low-bit weights directly with bitsandbytes
+        use_cuda = self.device == "cuda" and torch.cuda.is_available()
+        if use_cuda and quantization in ("int8", "int4") and BitsAndBytesConfig is not None:
+            load_kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_8bit=quantization == "int8",
+                load_in_4bit=quantization == "int4",
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.float16
+            )
+            logger.info(f"⚙️ Loading {model_name} with {quantization} bitsandbytes weights")
+            return AutoModelForCausalLM.from_pretrained(model_name, device_map="auto", **load_kwargs)
+        
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.float32,  # Use float32 for CPU compatibility
+            device_map=None,  # CPU only for stability
+            **load_kwargs
+        )
+        
+        # CPU: int8 dynamic quantization of the Linear layers (int4 falls back to int8)
+        if quantization in ("int8", "int4"):
+            logger.info(f"⚙️ Applying int8 dynamic quantization to {model_name}")
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            return model
+        
+        return self._compile_model(model)
+    
+    def _compile_model(self, model):
+        """
+        Compile the forward pass with torch.compile when settings.torch_compile is on.
+        Only called for unquantized weights: int8/int4 models stay eager
+        """
+        if not getattr(settings, 'torch_compile', False) or not hasattr(torch, "compile"):
+            return model
+        
+        # No CUDA graphs ("reduce-overhead"): graph replays share static buffers,
+        # and generate() runs on several executor threads at once
+        eager_forward = model.forward
+        
+        # Compiling forward keeps model.generate and the KV cache logic intact.
+        # torch.compile is lazy, so a tiny generate triggers compilation here,
+        # where a failure can still fall back to eager execution
+        try:
+            model.forward = torch.compile(eager_forward, mode="default", fullgraph=False)
+            warmup_ids = torch.zeros((1, 8), dtype=torch.long, device=model.device)
+            with torch.no_grad():
+                model.generate(warmup_ids, attention_mask=torch.ones_like(warmup_ids), max_new_tokens=2, pad_token_id=0)
+            logger.info("⚙️ Model forward pass compiled with torch.compile")
+        except Exception as e:
+            model.forward = eager_forward
+            logger.warning(f"⚠️ torch.compile failed, running eagerly: {str(e)}")
+        return model
+    
     async def generate_study_response(
         self,
         question: str,
@@ -197,7 +425,7 @@ class LlamaAIService:
             retry_count += 1
         
         # If model still failed, raise error - NO FALLBACKS
-        if not self.initialized or not self.model or not self.tokenizer:
+        if not self.initialized or not (self.model or self.vllm_engine) or not self.tokenizer:
             raise Exception("AI model failed to initialize. Cannot provide hardcoded responses.")
         
         try:
@@ -216,6 +444,17 @@ class LlamaAIService:
                 }
             ]
             
+            if self.vllm_engine is not None:
+                response = ""
+                async for response in self._vllm_stream(self._chat_text(messages), 80, 0.6):
+                    pass
+                response = response.strip()
+                if response and len(response) > 3:
+                    return response
+                # There is no transformers model to retry with when vLLM is the engine
+                logger.warning("⚠️ Generated response too short, using fallback...")
+                return SHORT_RESPONSE_FALLBACK.format(question=question)
+            
             logger.info("📝 Applying chat template...")
             # Use proper LLaMA 3.2 chat template
             inputs = self.tokenizer.apply_chat_template(
@@ -228,6 +467,7 @@ class LlamaAIService:
             
             logger.info("🔥 Generating response...")
             # Optimized generation for speed
+            inputs = inputs.to(self.model.device)
             with torch.no_grad():
                 outputs = self.model.generate(
                     inputs["input_ids"],
@@ -259,7 +499,7 @@ class LlamaAIService:
                 return response
             else:
                 logger.warning("⚠️ Generated response too short, using fallback...")
-                fallback_response = f"I understand you're asking about '{question}'. Let me help you with that topic."
+                fallback_response = SHORT_RESPONSE_FALLBACK.format(question=question)
                 print(f"🎯 FALLBACK RESPONSE: {fallback_response}")
                 return fallback_response
             
@@ -318,6 +558,9 @@ class LlamaAIService:
     
     async def _generate_with_llama(self, prompt: str) -> str:
         """Generate response using Llama 3.2 pipeline"""
+        if self.vllm_engine is not None:
+            return await self.agenerate(prompt, settings.max_tokens, settings.temperature)
+        
         try:
             # Run in thread pool to avoid blocking
             response = await asyncio.get_event_loop().run_in_executor(
@@ -329,6 +572,178 @@ class LlamaAIService:
             logging.error(f"Llama generation error: {str(e)}")
             raise
     
+    def count_tokens(self, text: str) -> int:
+        """Count tokens with the loaded tokenizer (estimated before initialization)"""
+        if self.tokenizer is None:
+            return len(text) // CHARS_PER_TOKEN_ESTIMATE
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+    
+    def prompt_token_budget(self, fixed_text: str) -> int:
+        """Tokens left for variable prompt content once fixed_text and the chat template are counted"""
+        return max(0, self.max_context_length - CHAT_TEMPLATE_TOKENS - self.count_tokens(fixed_text))
+    
+    def truncate_to_tokens(self, text: str, max_tokens: int) -> str:
+        """Trim text to at most max_tokens tokens without splitting a token"""
+        max_tokens = max(0, max_tokens)
+        if self.tokenizer is None:
+            return text[:max_tokens * CHARS_PER_TOKEN_ESTIMATE]
+        
+        token_ids = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(token_ids) <= max_tokens:
+            return text
+        return self.tokenizer.decode(token_ids[:max_tokens], skip_special_tokens=True)
+    
+    async def generate_response_stream(
+        self,
+        prompt: str,
+        max_tokens: int = 400,
+        temperature: float = 0.6
+    ) -> AsyncGenerator[str, None]:
+        """Yield generated text incrementally as the model decodes it"""
+        if not self.initialized:
+            await self.initialize()
+        
+        if self.vllm_engine is not None:
+            sent = 0
+            async for text in self._vllm_stream(self._chat_text([{"role": "user", "content": prompt}]), max_tokens, temperature):
+                if len(text) > sent:
+                    yield text[sent:]
+                    sent = len(text)
+            return
+        
+        if getattr(self.tokenizer, "chat_template", None):
+            inputs = self.tokenizer.apply_chat_template(
+                [{"role": "user", "content": prompt}],
+                add_generation_prompt=True,
+                tokenize=True,
+                return_dict=True,
+                return_tensors="pt",
+            )
+        else:
+            inputs = self.tokenizer(prompt, return_tensors="pt")
+        inputs = inputs.to(self.model.device)
+        
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_CHUNK_TIMEOUT
+        )
+        cancelled = threading.Event()
+        
+        def run_generation():
+            try:
+                with torch.no_grad():
+                    self.model.generate(
+                        inputs["input_ids"],
+                        attention_mask=inputs.get("attention_mask"),
+                        max_new_tokens=max_tokens,
+                        temperature=temperature,
+                        do_sample=True,
+                        top_p=0.9,
+                        pad_token_id=self.tokenizer.eos_token_id,
+                        eos_token_id=self.tokenizer.eos_token_id,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([StopOnEvent(cancelled)])
+                    )
+            except Exception:
+                # Release the reader below; the error is re-raised when generation is awaited
+                streamer.end()
+                raise
+        
+        loop = asyncio.get_event_loop()
+        generation = loop.run_in_executor(None, run_generation)
+        
+        # The streamer is a blocking iterator, so pull each chunk off the event loop.
+        # Leaving early (client disconnect, timeout) stops generate() at its next step
+        finished = object()
+        try:
+            while True:
+                try:
+                    text = await loop.run_in_executor(None, next, streamer, finished)
+                except queue.Empty:
+                    raise TimeoutError(f"No generated text within {STREAM_CHUNK_TIMEOUT} seconds")
+                if text is finished:
+                    break
+                if text:
+                    yield text
+            
+            await generation
+        finally:
+            cancelled.set()
+    
+    async def generate_batch(
+        self,
+        prompts: List[str],
+        max_new_tokens: int = 256,
+        temperature: float = 0.6,
+        json_schema: Optional[str] = None
+    ) -> List[str]:
+        """
+        Generate responses for several prompts in a single padded forward batch.
+        json_schema constrains decoding on vLLM; the transformers path ignores it
+        """
+        if not self.initialized:
+            await self.initialize()
+        
+        if not prompts:
+            return []
+        
+        if self.vllm_engine is not None:
+            # The engine's scheduler batches these itself
+            return list(await asyncio.gather(*(
+                self.agenerate(prompt, max_new_tokens, temperature, json_schema) for prompt in prompts
+            )))
+        
+        try:
+            # Run in thread pool to avoid blocking
+            return await asyncio.get_event_loop().run_in_executor(
+                None, self._sync_generate_batch, prompts, max_new_tokens, temperature
+            )
+        except Exception as e:
+            logging.error(f"Batch generation error: {str(e)}")
+            raise
+    
+    def _sync_generate_batch(self, prompts: List[str], max_new_tokens: int, temperature: float) -> List[str]:
+        """Synchronous batched generation"""
+        use_chat_template = bool(getattr(self.tokenizer, "chat_template", None))
+        if use_chat_template:
+            texts = [
+                self.tokenizer.apply_chat_template(
+                    [{"role": "user", "content": prompt}],
+                    tokenize=False,
+                    add_generation_prompt=True
+                )
+                for prompt in prompts
+            ]
+        else:
+            texts = prompts
+        
+        # Tokenizer pads on the left, so every prompt ends at the same position
+        inputs = self.tokenizer(
+            texts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=self.max_context_length,
+            add_special_tokens=not use_chat_template
+        ).to(self.model.device)
+        
+        with torch.no_grad():
+            outputs = self.model.generate(
+                inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                do_sample=temperature > 0,  # temperature 0 means greedy decoding
+                top_p=0.9,
+                pad_token_id=self.tokenizer.pad_token_id,
+                eos_token_id=self.tokenizer.eos_token_id
+            )
+        
+        prompt_length = inputs["input_ids"].shape[-1]
+        return [
+            self.tokenizer.decode(output[prompt_length:], skip_special_tokens=True).strip()
+            for output in outputs
+        ]
+    
     def _sync_generate(self, prompt: str) -> str:
         """Synchronous generation method"""
         try:
@@ -564,7 +979,7 @@ Explanation:"""
             explanation = await self._generate_with_llama(prompt)
             
             # Generate related concepts using embedding similarity
-            related_concepts = await self._find_related_concepts(concept, subject)
+            related_concepts = await self.find_related_concepts(concept, subject)
             
             return {
                 "concept": concept,
@@ -579,41 +994,39 @@ Explanation:"""
             logging.error(f"Concept explanation error: {str(e)}")
             raise
     
-    async def _find_related_concepts(self, concept: str, subject: str) -> List[str]:
+    async def find_related_concepts(self, concept: str, subject: str, limit: int = 3) -> List[str]:
         """Find related concepts using embeddings"""
+        if self.embedding_model is None:
+            return DEFAULT_RELATED_CONCEPTS
+        
         try:
-            # Get concept embedding
-            concept_embedding = self.embedding_model.encode([concept])
-            
-            # Predefined concept databases by subject
-            concept_db = {
-                "mathematics": ["algebra", "calculus", "geometry", "statistics", "trigonometry", "derivatives", "integrals", "equations", "functions", "probability"],
-                "physics": ["mechanics", "thermodynamics", "electromagnetism", "quantum", "relativity", "waves", "energy", "momentum", "force", "acceleration"],
-                "chemistry": ["atoms", "molecules", "reactions", "bonds", "periodic table", "acids", "bases", "organic", "inorganic", "kinetics"],
-                "computer science": ["algorithms", "data structures", "programming", "databases", "networks", "security", "machine learning", "AI", "software engineering"],
-                "biology": ["cells", "genetics", "evolution", "ecology", "anatomy", "physiology", "DNA", "proteins", "organisms", "ecosystems"]
-            }
+            subject_key = subject.lower() if subject.lower() in SUBJECT_CONCEPTS else "mathematics"
+            subject_concepts = SUBJECT_CONCEPTS[subject_key]
             
-            subject_concepts = concept_db.get(subject.lower(), concept_db.get("mathematics", []))
+            # Subject concept embeddings are encoded once and reused
+            concept_embeddings = self.concept_embeddings.get(subject_key)
+            if concept_embeddings is None:
+                concept_embeddings = await asyncio.to_thread(
+                    self.embedding_model.encode, subject_concepts, normalize_embeddings=True
+                )
+                self.concept_embeddings[subject_key] = concept_embeddings
             
-            if len(subject_concepts) > 0:
-                # Get embeddings for all concepts
-                concept_embeddings = self.embedding_model.encode(subject_concepts)
-                
-                # Calculate similarities
-                similarities = self.embedding_model.similarity(concept_embedding, concept_embeddings)[0]
-                
-                # Get top 3 most similar concepts
-                top_indices = similarities.argsort()[-4:][::-1]  # Top 4 excluding self
-                related = [subject_concepts[i] for i in top_indices if similarities[i] > 0.3]
-                
-                return related[:3]
+            concept_embedding = await asyncio.to_thread(
+                self.embedding_model.encode, concept, normalize_embeddings=True
+            )
             
-            return ["Practice Problems", "Study Methods", "Additional Resources"]
+            # Cosine similarity of unit vectors, most similar first
+            similarities = concept_embeddings @ concept_embedding
+            related = [
+                subject_concepts[i]
+                for i in similarities.argsort()[::-1]
+                if similarities[i] > 0.3 and subject_concepts[i].lower() != concept.lower()
+            ]
+            return related[:limit]
             
         except Exception as e:
             logging.error(f"Related concepts error: {str(e)}")
-            return ["Practice Problems", "Study Methods", "Additional Resources"]
+            return DEFAULT_RELATED_CONCEPTS
     
     async def get_model_status(self) -> Dict[str, Any]:
         """Get current model status"""
@@ -637,5 +1050,131 @@ Explanation:"""
         except Exception:
             return {"memory_info": "Unable to retrieve"}
 
+class GenerationBatcher:
+    """
+    Coalesces concurrent generation requests into batched forward passes, so
+    the model weights are read once per batch instead of once per request.
+    
+    Requests are binned by output budget, each bin with its own queue and
+    worker, so short grading calls never wait behind long quiz generations
+    """
+    
+    def __init__(
+        self,
+        service: LlamaAIService,
+        max_batch_size: int,
+        batch_window: float,
+        long_request_tokens: int
+    ):
+        self.service = service
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.long_request_tokens = long_request_tokens
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: List[asyncio.Task] = []
+    
+    async def start(self):
+        """Start one batching worker per bin on the running event loop"""
+        if not self._workers:
+            self._queues = {"short": asyncio.Queue(), "long": asyncio.Queue()}
+            self._workers = [asyncio.create_task(self._run(pending)) for pending in self._queues.values()]
+    
+    async def stop(self):
+        """Stop the workers and fail any requests still waiting"""
+        if not self._workers:
+            return
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        for pending in self._queues.values():
+            items = []
+            while not pending.empty():
+                items.append(pending.get_nowait())
+            self._fail_unresolved(items)
+        self._workers = []
+        self._queues = {}
+    
+    async def generate(
+        self,
+        prompt: str,
+        max_new_tokens: int = 256,
+        temperature: float = 0.6,
+        json_schema: Optional[str] = None
+    ) -> str:
+        """Queue a prompt in its length bin and wait for its slice of the next batch"""
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        bin_name = "long" if max_new_tokens > self.long_request_tokens else "short"
+        # A character estimate is enough to pick a bucket and avoids tokenizing twice
+        bucket = bisect.bisect_left(PROMPT_LENGTH_BUCKETS, len(prompt) // CHARS_PER_TOKEN_ESTIMATE)
+        await self._queues[bin_name].put((prompt, max_new_tokens, temperature, json_schema, bucket, future))
+        return await future
+    
+    @staticmethod
+    def _fail_unresolved(items: List[Tuple]):
+        """Fail the futures of requests that will never get a result"""
+        for *_, future in items:
+            if not future.done():
+                future.set_exception(RuntimeError("Generation batcher stopped"))
+    
+    async def _collect(self, queue: asyncio.Queue, batch: List[Tuple]):
+        """
+        Wait for one request, then gather more until the window closes or the
+        batch is full. Fills the caller's list so a cancelled worker can still
+        fail the requests it already took off the queue
+        """
+        batch.append(await queue.get())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+    
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            batch = []
+            try:
+                await self._collect(queue, batch)
+                
+                # Requests with different sampling settings cannot share a generate() call,
+                # and prompts of very different lengths would mostly pad each other
+                groups = defaultdict(list)
+                for item in batch:
+                    groups[item[1:5]].append(item)
+                
+                # Fullest group first
+                ordered_groups = sorted(groups.items(), key=lambda group: len(group[1]), reverse=True)
+                for (max_new_tokens, temperature, json_schema, _), items in ordered_groups:
+                    try:
+                        outputs = await self.service.generate_batch(
+                            [prompt for prompt, *_ in items],
+                            max_new_tokens=max_new_tokens,
+                            temperature=temperature,
+                            json_schema=json_schema
+                        )
+                    except Exception as e:
+                        for *_, future in items:
+                            if not future.done():
+                                future.set_exception(e)
+                        continue
+                    for (*_, future), output in zip(items, outputs):
+                        if not future.done():
+                            future.set_result(output)
+            finally:
+                # Cancellation (stop()) skips the handlers above; nothing taken off
+                # the queue may be left waiting forever
+                self._fail_unresolved(batch)
+
 # Create singleton instance
 llama_ai_service = LlamaAIService()
+generation_batcher = GenerationBatcher(
+    llama_ai_service,
+    max_batch_size=settings.llm_batch_max_size,
+    batch_window=settings.llm_batch_window_ms / 1000,
+    long_request_tokens=settings.llm_batch_long_request_tokens
+)
@@ -0,0 +1,220 @@
+# Model Output Parsers for AI Study Assistant
+# Turns raw LLaMA text into flashcards, quizzes, grades and practice problems
+
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+import re
+import orjson
+
+from models.quiz import QuizOutput, QuizRequest
+
+# Matches a "Q:" line and the first non-empty "A:" line after it,
+# without running past the next question. Captures exclude surrounding
+# whitespace so the whole parse stays inside the C regex engine.
+FLASHCARD_PATTERN = re.compile(
+    r'^[ \t]*Q:[ \t]*(\S(?:.*\S)?)[ \t\r]*$'
+    r'(?:\n(?![ \t]*Q:).*)*?'
+    r'\n[ \t]*A:[ \t]*(\S(?:.*\S)?)[ \t\r]*$',
+    re.MULTILINE
+)
+
+# Scores as graders write them: 85, 85%, 8/10
+GRADING_SCORE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(?:%|/\s*(\d+(?:\.\d+)?))?\s*$")
+
+# Practice problem lines: "Problem 1: ...", "Context: ...", "Approach: ...", "Hint: ..."
+PRACTICE_LINE_PATTERN = re.compile(r"^[ \t]*(Problem|Context:|Approach:|Hint:)(.*)$", re.MULTILINE)
+PRACTICE_FIELDS = {"Context:": "context", "Approach:": "approach", "Hint:": "hint"}
+
+def parse_flashcards_response(response: str) -> List[Dict[str, str]]:
+    """Parse flashcards from LLaMA response"""
+    created_at = datetime.utcnow().isoformat()
+    return [
+        {
+            'front': question,
+            'back': answer,
+            'difficulty': 'medium',
+            'created_at': created_at
+        }
+        for question, answer in FLASHCARD_PATTERN.findall(response)
+    ]
+
+class FlashcardStreamParser:
+    """Incrementally parse Q:/A: flashcards from streamed model output"""
+    
+    def __init__(self):
+        self.created_at = datetime.utcnow().isoformat()
+        self.buffer = ""
+        self.question = ""
+        self.answer = ""
+    
+    def feed(self, text: str) -> List[Dict[str, str]]:
+        """Consume a chunk of text and return any flashcards it completed"""
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split('\n')
+        return [card for card in map(self._consume_line, lines) if card]
+    
+    def close(self) -> List[Dict[str, str]]:
+        """Flush the trailing line and the last pending flashcard"""
+        cards = [self._consume_line(self.buffer), self._flush()]
+        self.buffer = ""
+        return [card for card in cards if card]
+    
+    def _consume_line(self, line: str) -> Optional[Dict[str, str]]:
+        line = line.strip()
+        if line.startswith('Q:'):
+            # A new question completes the previous card
+            card = self._flush()
+            self.question = line[2:].strip()
+            return card
+        if line.startswith('A:') and self.question and not self.answer:
+            self.answer = line[2:].strip()
+        return None
+    
+    def _flush(self) -> Optional[Dict[str, str]]:
+        card = None
+        if self.question and self.answer:
+            card = {
+                'front': self.question,
+                'back': self.answer,
+                'difficulty': 'medium',
+                'created_at': self.created_at
+            }
+        self.question = ""
+        self.answer = ""
+        return card
+
+def parse_study_set_response(response: str):
+    """Split a combined study set response into flashcards and quiz questions"""
+    try:
+        data = orjson.loads(response[response.index("{"):response.rindex("}") + 1])
+    except ValueError:
+        # Not valid JSON; salvage any Q:/A: flashcards the model wrote instead
+        return parse_flashcards_response(response), []
+    
+    created_at = datetime.utcnow().isoformat()
+    flashcards = [
+        {
+            'front': str(card['question']).strip(),
+            'back': str(card['answer']).strip(),
+            'difficulty': 'medium',
+            'created_at': created_at
+        }
+        for card in data.get("flashcards") or []
+        if isinstance(card, dict) and card.get("question") and card.get("answer")
+    ]
+    questions = [
+        question
+        for question in data.get("questions") or []
+        if isinstance(question, dict) and question.get("question") and question.get("options")
+    ]
+    return flashcards, questions
+
+def parse_quiz_response(response: str, quiz_id: str, request: QuizRequest) -> Dict[str, Any]:
+    """Parse quiz response from LLaMA"""
+    try:
+        # Unguided models often wrap their JSON in a code fence or prose
+        data = orjson.loads(response[response.index("{"):response.rindex("}") + 1])
+        quiz_data = QuizOutput.model_validate(normalize_quiz_output(data, request)).model_dump()
+        if not quiz_data["questions"]:
+            return create_fallback_quiz(quiz_id, request)
+        
+        # Add metadata
+        quiz_data["metadata"] = {
+            "quiz_id": quiz_id,
+            "ai_generated": True,
+            "topic": request.topic,
+            "subject": request.subject,
+            "difficulty": request.difficulty
+        }
+        
+        return quiz_data
+        
+    except ValueError:
+        # Not JSON, or not quiz-shaped even after filling defaults
+        return create_fallback_quiz(quiz_id, request)
+
+def normalize_quiz_output(data: Any, request: QuizRequest) -> Dict[str, Any]:
+    """
+    Fill what unguided models commonly leave out or mistype (titles, question
+    ids, boolean answers) so lax validation accepts otherwise usable quizzes
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Quiz response is not a JSON object")
+    
+    questions = []
+    for index, question in enumerate(data.get("questions") or [], start=1):
+        if not isinstance(question, dict) or not question.get("question"):
+            continue
+        answer = question.get("correct_answer")
+        if isinstance(answer, bool):
+            answer = "True" if answer else "False"
+        questions.append({
+            **question,
+            "id": str(question.get("id") or f"q{index}"),
+            "type": question.get("type") or ("multiple_choice" if question.get("options") else "short_answer"),
+            "correct_answer": "" if answer is None else answer
+        })
+    
+    return {**data, "title": data.get("title") or f"{request.topic} Quiz", "questions": questions}
+
+def create_fallback_quiz(quiz_id: str, request: QuizRequest) -> Dict[str, Any]:
+    """Create a basic fallback quiz when AI generation fails"""
+    return {
+        "title": f"{request.topic} Practice Quiz",
+        "description": f"Practice quiz covering {request.topic} concepts",
+        "questions": [
+            {
+                "id": f"q{i}",
+                "type": "multiple_choice",
+                "question": f"Question {i} about {request.topic}",
+                "options": ["A) Option 1", "B) Option 2", "C) Option 3", "D) Option 4"],
+                "correct_answer": "A",
+                "explanation": "This is a placeholder question generated due to AI processing error.",
+                "difficulty": request.difficulty,
+                "points": 10,
+                "concept": request.topic
+            }
+            for i in range(1, min(request.num_questions + 1, 6))  # Max 5 fallback questions
+        ],
+        "metadata": {
+            "quiz_id": quiz_id,
+            "ai_generated": False,
+            "fallback": True,
+            "topic": request.topic,
+            "subject": request.subject,
+            "difficulty": request.difficulty
+        }
+    }
+
+def parse_grading_score(value: Any) -> Optional[float]:
+    """Read a 0-100 score from model output such as 85, "85", "85%" or "8/10"; None if unreadable"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return max(0.0, min(100.0, float(value)))
+    
+    match = GRADING_SCORE_PATTERN.match(value) if isinstance(value, str) else None
+    if not match:
+        return None
+    score = float(match.group(1))
+    if match.group(2):
+        out_of = float(match.group(2))
+        if not out_of:
+            return None
+        score = score * 100 / out_of
+    return max(0.0, min(100.0, score))
+
+def parse_practice_problems(response: str) -> List[Dict[str, str]]:
+    """Parse practice problems from LLaMA response"""
+    problems = []
+    current_problem = None
+    
+    for match in PRACTICE_LINE_PATTERN.finditer(response):
+        label, text = match.group(1), match.group(2).strip()
+        if label == "Problem":
+            current_problem = {"statement": f"Problem{match.group(2)}".strip(), "id": str(len(problems) + 1)}
+            problems.append(current_problem)
+        elif current_problem is not None:
+            current_problem[PRACTICE_FIELDS[label]] = text
+    
+    return problems
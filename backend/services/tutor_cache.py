@@ -0,0 +1,98 @@
+# Semantic cache for tutor replies
+# Serves repeated and near-identical tutoring prompts without a model call
+
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+
+from core.cache import TTLCache
+from core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase and collapse whitespace so trivially different prompts share a key"""
+    return " ".join(text.lower().split())
+
+class SemanticTutorCache:
+    """
+    Tutor replies keyed by the normalized prompt. When an embedding model is
+    available, a prompt whose embedding is close enough to a cached one in the
+    same scope reuses that reply too
+    """
+
+    def __init__(self, maxsize: int, ttl: float, similarity_threshold: float, max_scopes: int):
+        self.maxsize = maxsize
+        self.similarity_threshold = similarity_threshold
+        self.max_scopes = max_scopes
+        self._replies = TTLCache(maxsize=maxsize, ttl=ttl)
+        # scope -> key -> unit-length prompt embedding, least recently used scope first
+        self._vectors: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+
+    @staticmethod
+    def make_key(message: str, scope: str) -> str:
+        """Hash a prompt and the scope it was asked in"""
+        return hashlib.sha256(f"{scope}|{normalize_prompt(message)}".encode()).hexdigest()[:32]
+
+    async def lookup(
+        self,
+        message: str,
+        scope: str = "",
+        embedding_model: Optional[Any] = None
+    ) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Return a cached reply, or None, together with the prompt's embedding so
+        a miss can be stored without encoding the prompt again
+        """
+        reply = self._replies.get(self.make_key(message, scope))
+        if reply is not None or embedding_model is None:
+            return reply, None
+
+        try:
+            vector = await asyncio.to_thread(embedding_model.encode, message, normalize_embeddings=True)
+        except Exception as e:
+            logger.warning(f"Tutor cache embedding failed: {str(e)}")
+            return None, None
+
+        vectors = self._vectors.get(scope)
+        if not vectors:
+            return None, vector
+        self._vectors.move_to_end(scope)
+
+        keys = list(vectors)
+        similarities = np.stack([vectors[key] for key in keys]) @ vector
+        for index in np.argsort(similarities)[::-1]:
+            if similarities[index] < self.similarity_threshold:
+                break
+            reply = self._replies.get(keys[index])
+            if reply is not None:
+                return reply, vector
+            # The reply expired or was evicted
+            del vectors[keys[index]]
+        return None, vector
+
+    def store(self, message: str, reply: str, scope: str = "", vector: Optional[np.ndarray] = None):
+        """Cache a reply, and its prompt embedding for near-match lookups"""
+        key = self.make_key(message, scope)
+        self._replies.set(key, reply)
+        if vector is None:
+            return
+
+        vectors = self._vectors.setdefault(scope, {})
+        self._vectors.move_to_end(scope)
+        vectors[key] = vector
+        while len(vectors) > self.maxsize:
+            del vectors[next(iter(vectors))]
+        while len(self._vectors) > self.max_scopes:
+            self._vectors.popitem(last=False)
+
+tutor_cache = SemanticTutorCache(
+    maxsize=settings.tutor_cache_size,
+    ttl=settings.tutor_cache_ttl,
+    similarity_threshold=settings.tutor_cache_similarity,
+    max_scopes=settings.tutor_cache_max_scopes
+)
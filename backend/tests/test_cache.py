@@ -0,0 +1,72 @@
+"""
+Tests for the in-process TTL cache
+"""
+from core.cache import TTLCache, make_etag, etag_matches
+
+class TestTTLCache:
+    """Test TTL cache behaviour."""
+
+    def test_set_and_get(self):
+        """Test storing and retrieving a value."""
+        cache = TTLCache(maxsize=4, ttl=60)
+        cache.set("key", {"value": 1})
+
+        assert cache.get("key") == {"value": 1}
+        assert cache.get("missing") is None
+        assert cache.get("missing", "default") == "default"
+
+    def test_expired_entries_are_dropped(self):
+        """Test that entries past their TTL are not returned."""
+        cache = TTLCache(maxsize=4, ttl=-1)
+        cache.set("key", "value")
+
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+    def test_least_recently_used_is_evicted(self):
+        """Test that the cache stays within maxsize."""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert len(cache) == 2
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_pop_and_clear(self):
+        """Test removing entries."""
+        cache = TTLCache(maxsize=4, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        assert cache.pop("a") == 1
+        assert cache.pop("a") is None
+        cache.clear()
+        assert len(cache) == 0
+
+class TestETags:
+    """Test ETag helpers."""
+
+    def test_make_etag_is_weak_and_stable(self):
+        """Test that equal inputs produce the same weak ETag."""
+        etag = make_etag("user", "fingerprint")
+
+        assert etag.startswith('W/"')
+        assert etag == make_etag("user", "fingerprint")
+        assert etag != make_etag("user", "other")
+        assert make_etag(b"body") == make_etag(b"body")
+
+    def test_etag_matches(self):
+        """Test If-None-Match comparison."""
+        etag = make_etag(b"body")
+        opaque = etag[2:]
+
+        assert etag_matches(etag, etag)
+        assert etag_matches(opaque, etag)
+        assert etag_matches(f'"other", {etag}', etag)
+        assert etag_matches("*", etag)
+        assert not etag_matches(None, etag)
+        assert not etag_matches('"other"', etag)
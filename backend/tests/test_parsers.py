@@ -0,0 +1,145 @@
+"""
+Tests for parsing model output into flashcards, quizzes, grades and practice problems
+"""
+from models.quiz import QuizRequest
+from services.response_parsers import (
+    FlashcardStreamParser,
+    parse_flashcards_response,
+    parse_grading_score,
+    parse_practice_problems,
+    parse_quiz_response,
+    parse_study_set_response
+)
+
+class TestFlashcardParsing:
+    """Test Q:/A: flashcard parsing."""
+
+    def test_parse_flashcards_response(self):
+        """Test that each question pairs with the first answer after it."""
+        response = "Intro text\nQ: What is a variable?\n\nA: A named value\nQ: Unanswered?\nQ:  What is a loop? \nA: Repetition\nA: Ignored"
+        cards = parse_flashcards_response(response)
+
+        assert [(card["front"], card["back"]) for card in cards] == [
+            ("What is a variable?", "A named value"),
+            ("What is a loop?", "Repetition")
+        ]
+        assert all(card["difficulty"] == "medium" for card in cards)
+
+    def test_stream_parser_matches_batch_parser(self):
+        """Test that streamed chunks yield the same cards as a full parse."""
+        response = "Q: First?\nA: One\nQ: Second?\nA: Two"
+        parser = FlashcardStreamParser()
+        cards = []
+        for start in range(0, len(response), 5):
+            cards.extend(parser.feed(response[start:start + 5]))
+        cards.extend(parser.close())
+
+        assert [(card["front"], card["back"]) for card in cards] == [("First?", "One"), ("Second?", "Two")]
+
+class TestStudySetParsing:
+    """Test combined flashcard and quiz question parsing."""
+
+    def test_parse_json_study_set(self):
+        """Test JSON wrapped in prose, skipping incomplete entries."""
+        response = (
+            'Here you go:\n```json\n{"flashcards": [{"question": "Q1", "answer": "A1"}, {"question": "Q2"}], '
+            '"questions": [{"question": "Pick one", "options": ["A) x", "B) y"]}, {"question": "No options"}]}\n```'
+        )
+        flashcards, questions = parse_study_set_response(response)
+
+        assert [(card["front"], card["back"]) for card in flashcards] == [("Q1", "A1")]
+        assert [question["question"] for question in questions] == ["Pick one"]
+
+    def test_falls_back_to_flashcard_lines(self):
+        """Test that non-JSON output still yields Q:/A: flashcards."""
+        flashcards, questions = parse_study_set_response("Q: What is AI?\nA: Artificial intelligence")
+
+        assert [(card["front"], card["back"]) for card in flashcards] == [("What is AI?", "Artificial intelligence")]
+        assert questions == []
+
+class TestQuizParsing:
+    """Test quiz JSON parsing."""
+
+    def setup_method(self):
+        self.request = QuizRequest(topic="Python", subject="programming", num_questions=2)
+
+    def test_parse_quiz_with_missing_fields(self):
+        """Test that usable questions survive missing ids, types and titles."""
+        response = (
+            '```json\n{"questions": ['
+            '{"question": "2 + 2?", "options": [3, 4], "correct_answer": 4},'
+            '{"question": "Python is dynamically typed", "type": "true_false", "correct_answer": true},'
+            '{"options": ["no question text"]}'
+            ']}\n```'
+        )
+        quiz = parse_quiz_response(response, "quiz_1", self.request)
+
+        assert quiz["title"] == "Python Quiz"
+        assert [question["id"] for question in quiz["questions"]] == ["q1", "q2"]
+        assert quiz["questions"][0]["type"] == "multiple_choice"
+        assert quiz["questions"][0]["options"] == ["3", "4"]
+        assert quiz["questions"][0]["correct_answer"] == "4"
+        assert quiz["questions"][1]["correct_answer"] == "True"
+        assert quiz["metadata"]["quiz_id"] == "quiz_1"
+        assert quiz["metadata"]["ai_generated"] is True
+
+    def test_unparseable_quiz_falls_back(self):
+        """Test that non-JSON or question-less output returns the fallback quiz."""
+        for response in ["not json at all", '{"title": "Empty", "questions": []}', '{"questions": "none"}']:
+            quiz = parse_quiz_response(response, "quiz_1", self.request)
+
+            assert quiz["metadata"]["fallback"] is True
+            assert quiz["metadata"]["quiz_id"] == "quiz_1"
+
+class TestGradingScoreParsing:
+    """Test reading scores from model grading output."""
+
+    def test_numeric_and_string_scores(self):
+        """Test the score formats models commonly produce."""
+        assert parse_grading_score(85) == 85.0
+        assert parse_grading_score(72.5) == 72.5
+        assert parse_grading_score("85") == 85.0
+        assert parse_grading_score(" 85% ") == 85.0
+        assert parse_grading_score("8/10") == 80.0
+
+    def test_scores_are_clamped(self):
+        """Test that out-of-range scores are clamped to 0-100."""
+        assert parse_grading_score(150) == 100.0
+        assert parse_grading_score(-5) == 0.0
+        assert parse_grading_score("12/10") == 100.0
+
+    def test_unreadable_scores(self):
+        """Test that unusable values are reported as None."""
+        for value in [None, True, "", "excellent", "5/0", [90], {"score": 90}]:
+            assert parse_grading_score(value) is None
+
+class TestPracticeProblemParsing:
+    """Test practice problem parsing."""
+
+    def test_parse_practice_problems(self):
+        """Test that labelled lines attach to the preceding problem."""
+        response = (
+            "Hint: ignored before any problem\n"
+            "Problem 1: Solve x + 2 = 5\n"
+            "Context: Linear equations\n"
+            "Approach: Subtract 2 from both sides\n"
+            "Hint: x is small\n"
+            "  Problem 2: Factor x^2 - 1\n"
+            "Hint: Difference of squares\n"
+        )
+        problems = parse_practice_problems(response)
+
+        assert problems == [
+            {
+                "statement": "Problem 1: Solve x + 2 = 5",
+                "id": "1",
+                "context": "Linear equations",
+                "approach": "Subtract 2 from both sides",
+                "hint": "x is small"
+            },
+            {"statement": "Problem 2: Factor x^2 - 1", "id": "2", "hint": "Difference of squares"}
+        ]
+
+    def test_no_problems(self):
+        """Test output without any Problem lines."""
+        assert parse_practice_problems("Just some prose") == []
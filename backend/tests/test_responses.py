@@ -0,0 +1,45 @@
+"""
+Tests for orjson response rendering of MongoDB documents
+"""
+from datetime import datetime
+
+import orjson
+import pytest
+from bson import ObjectId
+
+from core.responses import MongoJSONResponse, dumps
+
+class TestDumps:
+    """Test encoding MongoDB documents."""
+
+    def test_object_id_and_datetime(self):
+        """Test that BSON ids and datetimes serialize as strings."""
+        object_id = ObjectId()
+        created_at = datetime(2024, 1, 2, 3, 4, 5)
+        data = orjson.loads(dumps({"_id": object_id, "created_at": created_at, "tags": [object_id]}))
+
+        assert data == {
+            "_id": str(object_id),
+            "created_at": "2024-01-02T03:04:05",
+            "tags": [str(object_id)]
+        }
+
+    def test_non_string_keys(self):
+        """Test that non-string keys are accepted like stdlib json."""
+        assert orjson.loads(dumps({1: "one"})) == {"1": "one"}
+
+    def test_unsupported_type(self):
+        """Test that unknown types still raise."""
+        with pytest.raises(TypeError):
+            dumps({"value": object()})
+
+class TestMongoJSONResponse:
+    """Test the MongoDB-aware JSON response."""
+
+    def test_render(self):
+        """Test that the response body is the orjson encoding."""
+        object_id = ObjectId()
+        response = MongoJSONResponse({"_id": object_id, "count": 2})
+
+        assert response.media_type == "application/json"
+        assert orjson.loads(response.body) == {"_id": str(object_id), "count": 2}